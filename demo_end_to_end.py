@@ -145,8 +145,8 @@ async def demo_workflow():
     print(f"   Storage contains {storage_provider.count()} responses")
     
     stored_responses = storage_provider.get_all_responses()
-    for question_text, response in stored_responses.items():
-        print(f"   - Stored: {question_text[:50]}...")
+    for (template, word_set), response in stored_responses.items():
+        print(f"   - Stored: {template.format_map(dict(word_set))[:50]}...")
     
     # 5. Test retrieval from storage
     print(f"\n5. Testing retrieval from storage...")
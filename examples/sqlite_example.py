@@ -111,6 +111,9 @@ async def basic_sqlite_example():
         new_storage.clear()
         print(f"Count after clear: {new_storage.count()}")
         
+        storage.close()
+        new_storage.close()
+        
     finally:
         # Clean up the temporary database
         print(f"\nCleaning up temporary database: {db_path}")
@@ -175,6 +178,8 @@ async def workflow_integration_example():
         else:
             print("✗ Persistence issue - different responses")
         
+        storage.close()
+        
     finally:
         # Clean up
         print(f"\nCleaning up: {db_path}")
@@ -31,15 +31,15 @@ async def example_1_simple_yes_no():
     )
     
     print(f"\nResults: {len(df)} rows")
-    for _, row in df.iterrows():
-        print(f"\n{row['department']} in {row['country']}:")
-        if row['parsing_success']:
-            data = row['structured_data']
+    for row in df.itertuples(index=False):
+        print(f"\n{row.department} in {row.country}:")
+        if row.parsing_success:
+            data = row.structured_data
             print(f"  Answer: {data['answer']}")
             print(f"  Confidence: {data['confidence']}")
             print(f"  Explanation: {data['explanation'][:100]}...")
         else:
-            print(f"  Error: {row['parsing_error']}")
+            print(f"  Error: {row.parsing_error}")
     
     return df
 
@@ -67,10 +67,10 @@ async def example_2_cybersecurity_assessment():
     )
     
     print(f"\nResults: {len(df)} rows")
-    for _, row in df.iterrows():
-        print(f"\n{row['ministry']} Ministry in {row['country']}:")
-        if row['parsing_success']:
-            data = row['structured_data']
+    for row in df.itertuples(index=False):
+        print(f"\n{row.ministry} Ministry in {row.country}:")
+        if row.parsing_success:
+            data = row.structured_data
             print(f"  Has Cybersecurity Responsibilities: {data['has_cybersecurity_responsibilities']}")
             print(f"  Confidence: {data['confidence']}")
             print(f"  Scope: {data['scope']}")
@@ -79,7 +79,7 @@ async def example_2_cybersecurity_assessment():
             if data['additional_notes']:
                 print(f"  Notes: {data['additional_notes'][:100]}...")
         else:
-            print(f"  Error: {row['parsing_error']}")
+            print(f"  Error: {row.parsing_error}")
     
     return df
 
@@ -109,15 +109,15 @@ async def example_3_mixed_questions():
     )
     
     print(f"\nResults: {len(df)} rows")
-    for _, row in df.iterrows():
-        print(f"\nQuestion: {row['research_question']}")
-        if row['parsing_success']:
-            data = row['structured_data']
+    for row in df.itertuples(index=False):
+        print(f"\nQuestion: {row.research_question}")
+        if row.parsing_success:
+            data = row.structured_data
             print(f"  Answer: {data['answer']}")
             print(f"  Confidence: {data['confidence']}")
             print(f"  Sources: {len(data['sources'])} cited")
         else:
-            print(f"  Error: {row['parsing_error']}")
+            print(f"  Error: {row.parsing_error}")
     
     return df
 
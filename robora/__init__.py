@@ -4,4 +4,20 @@ from .classes import Question, QuestionSet, Answer, QueryResponse, QueryHandler,
 from .session_storage import SessionStorageProvider
 from .sqlite_storage import SQLiteStorageProvider
 from .workflow import Workflow
-from .sonar_query import SonarQueryHandler
\ No newline at end of file
+from .cache import ResponseCache
+from .batching import BatchingQueryHandler
+
+__all__ = [
+    "Question", "QuestionSet", "Answer", "QueryResponse", "QueryHandler", "StorageProvider",
+    "SessionStorageProvider", "SQLiteStorageProvider", "Workflow", "SonarQueryHandler",
+    "ResponseCache", "BatchingQueryHandler",
+]
+
+
+def __getattr__(name):
+    # SonarQueryHandler pulls in httpx and loads .env through CONFIG, so it is
+    # only imported on first access rather than with the package.
+    if name == "SonarQueryHandler":
+        from .sonar_query import SonarQueryHandler
+        return SonarQueryHandler
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,87 @@
+"""Query handler wrapper that coalesces concurrent prompts into batches."""
+
+import asyncio
+from typing import Any, Dict, List, Optional, Set, Tuple, Type
+
+from pydantic import BaseModel
+
+from robora.classes import QueryHandler, QueryResponse
+
+
+class BatchingQueryHandler(QueryHandler):
+    """Wrap a QueryHandler so prompts arriving close together share one query_batch call.
+
+    Prompts are buffered until max_batch_size of them are waiting or
+    max_latency_ms has passed since the first one arrived, then sent
+    together through the wrapped handler's query_batch. Each caller gets
+    back only the response for its own prompt.
+    """
+
+    def __init__(self, query_handler: QueryHandler, max_batch_size: int = 8, max_latency_ms: float = 50.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.query_handler = query_handler
+        self.max_batch_size = max_batch_size
+        self.max_latency_ms = max_latency_ms
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Keeps in-flight sends referenced until they finish.
+        self._sending: Set[asyncio.Task] = set()
+
+    @property
+    def response_model(self) -> Optional[Type[BaseModel]]:
+        return getattr(self.query_handler, "response_model", None)
+
+    @property
+    def model(self) -> Optional[str]:
+        return getattr(self.query_handler, "model", None)
+
+    async def query(self, prompt: str) -> QueryResponse:
+        return await self._enqueue(prompt)
+
+    async def query_batch(self, prompts: List[str]) -> List[QueryResponse]:
+        return list(await asyncio.gather(*(self._enqueue(p) for p in prompts)))
+
+    def extract_fields(self, full_response: Dict[str, Any]) -> dict[str, Any]:
+        return self.query_handler.extract_fields(full_response)
+
+    def _enqueue(self, prompt: str) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((prompt, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_latency_ms / 1000, self._flush)
+        return future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._send(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        try:
+            responses = await self.query_handler.query_batch([prompt for prompt, _ in batch])
+            if len(responses) != len(batch):
+                raise ValueError(f"query_batch returned {len(responses)} responses for {len(batch)} prompts")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), response in zip(batch, responses):
+            # A caller that was cancelled no longer wants its response.
+            if not future.done():
+                future.set_result(response)
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(query_handler={self.query_handler!r}, "
+            f"max_batch_size={self.max_batch_size}, max_latency_ms={self.max_latency_ms})"
+        )
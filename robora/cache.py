@@ -0,0 +1,93 @@
+"""Content-addressable on-disk cache of raw query responses."""
+
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Optional, Type
+
+from pydantic import BaseModel
+
+from robora import _json
+from robora.classes import QueryHandler
+
+
+@functools.lru_cache(maxsize=None)
+def _schema_bytes(response_model: Optional[Type[BaseModel]]) -> bytes:
+    schema = response_model.model_json_schema() if response_model is not None else None
+    return json.dumps(schema, sort_keys=True).encode()
+
+
+def response_cache_key(query_handler: QueryHandler, prompt: str) -> str:
+    """Return the cache key for sending ``prompt`` through ``query_handler``.
+
+    The key is the sha256 of provider, model, prompt and response schema.
+    Each part is prefixed with its 8-byte length, so shifting bytes from one
+    part into the next can never produce the same key.
+    """
+    parts = (
+        type(query_handler).__name__.encode(),
+        str(getattr(query_handler, "model", "")).encode(),
+        prompt.encode(),
+        _schema_bytes(getattr(query_handler, "response_model", None)),
+    )
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Directory of ``<key>.json`` files holding successful raw responses."""
+
+    def __init__(self, cache_dir: str | os.PathLike):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached response for ``key``, or None on a miss."""
+        def _get():
+            try:
+                with open(self._path(key), "rb") as f:
+                    return _json.loads(f.read())
+            except (FileNotFoundError, _json.JSONDecodeError):
+                return None
+
+        value = await asyncio.get_running_loop().run_in_executor(None, _get)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def put(self, key: str, value: Dict[str, Any]) -> None:
+        """Store ``value`` under ``key``; the file is replaced atomically."""
+        def _put():
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(_json.dumps_bytes(value))
+                os.replace(tmp_path, self._path(key))
+            except BaseException:
+                # Don't leave a partial temp file behind in the cache directory.
+                os.unlink(tmp_path)
+                raise
+
+        await asyncio.get_running_loop().run_in_executor(None, _put)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __repr__(self) -> str:
+        return f"ResponseCache(cache_dir='{self.cache_dir}', hits={self.hits}, misses={self.misses})"
@@ -0,0 +1,43 @@
+"""Citation enrichment shared by the query handlers."""
+
+from typing import Any, Dict, List
+
+
+def enrich_citations(full_response: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Pair each cited URL in a chat-completion response with its search result.
+
+    Every citation gets the same keys. Those with no search result for
+    their URL keep None metadata and matched=False. A URL cited more than
+    once keeps each of its positions; its entry is built once and copied
+    for the repeats, so each citation is still its own dict.
+    """
+    search_lookup = {result.get('url', ''): result for result in full_response.get('search_results', [])}
+    by_url: Dict[str, Dict[str, Any]] = {}
+    enriched_citations = []
+    for citation_url in full_response.get('citations', []):
+        entry = by_url.get(citation_url)
+        if entry is not None:
+            enriched_citations.append(dict(entry))
+            continue
+        search_result = search_lookup.get(citation_url)
+        if search_result is None:
+            entry = {
+                'url': citation_url,
+                'title': None,
+                'snippet': None,
+                'date': None,
+                'last_updated': None,
+                'matched': False
+            }
+        else:
+            entry = {
+                'url': citation_url,
+                'title': search_result.get('title'),
+                'snippet': search_result.get('snippet'),
+                'date': search_result.get('date'),
+                'last_updated': search_result.get('last_updated'),
+                'matched': True
+            }
+        by_url[citation_url] = entry
+        enriched_citations.append(entry)
+    return enriched_citations
@@ -1,125 +1,273 @@
-
 from abc import ABC, abstractmethod
-from typing import Type, Optional, Dict, Any
-from pydantic import BaseModel
-import pandas as pd
-from itertools import product
+from itertools import chain, islice, product
+import hashlib
 import math
-from typing import Dict, List, Any, Optional, Type, Union, Tuple, final, AsyncIterable, cast
-import json
-from pydantic import BaseModel, ValidationError
-import pandas as pd
+import sys
+from functools import cached_property
+from typing import TYPE_CHECKING, Dict, List, Any, Optional, Type, Tuple, final, AsyncIterable, FrozenSet, Iterator, Mapping, cast
+import asyncio
+import logging
+from string import Formatter
+from types import MappingProxyType
+from pydantic import BaseModel
+
+# pandas (and numpy) are only needed to flatten answers, so they are
+# imported on first use rather than whenever robora is imported.
+if TYPE_CHECKING:
+    import pandas as pd
 
 # Removed the storage import since it doesn't exist
 
+logger = logging.getLogger(__name__)
+
 @final
 class Question:
+    word_set: Dict[str, str]
+    template: str
+    response_model: Type[BaseModel]
+
     def __init__(self, word_set: Dict[str, str], template: str, response_model:Type[BaseModel]):
         self.word_set = word_set
         self.template = template
         self.response_model = response_model
 
-    @property
+    @cached_property
     def value(self) -> str:
-        
-        return str.format(self.template, **self.word_set)
+        # Rendered once per question; the workflow reads it several times
+        # (dedup key, prompt, Answer.question_value).
+        return self.template.format_map(self.word_set)
     
     def __repr__(self) -> str:
         return f"Question(template={self.template}, word_set={self.word_set})"
     
+    @cached_property
+    def key(self) -> Tuple[str, FrozenSet[Tuple[str, str]]]:
+        # Storage identity: the template plus the word_set contents. Built
+        # once per question since every storage call looks it up; word_set
+        # must not be mutated afterwards.
+        return (self.template, frozenset(self.word_set.items()))
+
+    @cached_property
+    def fingerprint(self) -> int:
+        # Signed 64-bit BLAKE2b digest of the template and sorted word_set.
+        # Unlike hash(), which is salted per process, it is stable across
+        # runs, so persistent storage can use it as a key. It can collide,
+        # so storage checks the stored template and word_set on every hit.
+        digest = hashlib.blake2b(digest_size=8)
+        for part in (self.template, *chain.from_iterable(sorted(self.word_set.items()))):
+            data = str(part).encode()
+            digest.update(len(data).to_bytes(8, "big"))
+            digest.update(data)
+        return int.from_bytes(digest.digest(), "big", signed=True)
+
     def __hash__(self) -> int:
-        return hash((self.template, frozenset(self.word_set.items())))
+        return hash(self.key)
 
     
 @final
 class QuestionSet:
+    template: str
+    word_sets: Dict[str, List[str]]
+    response_model: Type[BaseModel]
+    max_questions: Optional[int]
+
     def __init__(self, template: str, word_sets: Dict[str, List[str]], response_model:Type[BaseModel], max_questions: Optional[int]=None):
         self.template = template
         self.word_sets = word_sets
         self.response_model = response_model
         self.max_questions = max_questions
+        # Axis names are interned once so every word_set dict built from
+        # them shares the same key objects, and lookups during formatting
+        # and hashing hit the identity fast path.
+        self._keys = tuple(sys.intern(k) for k in word_sets.keys())
+        self._values = tuple(word_sets.values())
+
+        # Keys the template's placeholders refer to.
+        placeholders = set()
+        for _, field, _, _ in Formatter().parse(template):
+            if field:
+                placeholders.add(field.partition('.')[0].partition('[')[0])
+        # Positions of the axes the template uses, and the names and values
+        # of those it ignores; combos differing only on ignored axes render
+        # the same prompt, so only the used axes need enumerating.
+        self._used_positions = tuple(i for i, key in enumerate(self._keys) if key in placeholders)
+        self._unused_keys = tuple(key for key in self._keys if key not in placeholders)
+        self._unused_values = tuple(word_sets[key] for key in self._unused_keys)
+        if self._unused_keys:
+            logger.debug(
+                "word_sets keys %s do not appear in the template; each prompt is asked once "
+                "and its answer repeated across their values", list(self._unused_keys),
+            )
 
     def get_count(self) -> int:
-        return math.prod(len(v) for v in self.word_sets.values())
-
-    def get_questions(self) -> List[Question]:
-        combos = product(*(self.word_sets.values()))
-        questions = []
-        for i,combo in enumerate(combos):
-            if (self.max_questions is not None and self.max_questions > 0) and i >= self.max_questions:
-                break
-            word_set = dict(zip(self.word_sets.keys(), combo))
-            questions.append(Question(word_set, self.template, self.response_model))
-        return questions
-    
+        """Number of questions get_questions yields."""
+        count = math.prod(len(v) for v in self.word_sets.values())
+        if self.max_questions is not None and self.max_questions > 0:
+            count = min(count, self.max_questions)
+        return count
+
+    def get_questions(self) -> Iterator[Question]:
+        """Yield one Question per word_set combination, lazily."""
+        combos = product(*self._values)
+        if self.max_questions is not None and self.max_questions > 0:
+            combos = islice(combos, self.max_questions)
+        keys = self._keys
+        for combo in combos:
+            yield Question(dict(zip(keys, combo)), self.template, self.response_model)
+
+    def get_distinct_count(self) -> int:
+        """Number of questions get_distinct_questions yields (ignores max_questions)."""
+        if not all(self._unused_values):
+            return 0
+        return math.prod(len(self._values[i]) for i in self._used_positions)
+
+    def get_distinct_questions(self) -> Iterator[Question]:
+        """Yield one Question per combination of the axes the template uses.
+
+        Axes the template ignores are pinned to their first value, so each
+        yielded Question is also one of get_questions' and matches what
+        storage holds for it. Pass it to broadcast for the rest.
+        """
+        if not all(self._unused_values):
+            return
+        base = [values[0] if values else None for values in self._values]
+        positions = self._used_positions
+        keys = self._keys
+        for combo in product(*(self._values[i] for i in positions)):
+            row = base.copy()
+            for i, value in zip(positions, combo):
+                row[i] = value
+            yield Question(dict(zip(keys, row)), self.template, self.response_model)
+
+    def broadcast(self, question: Question) -> Iterator[Question]:
+        """Yield question, then one Question per other value of the ignored axes.
+
+        question must come from get_distinct_questions. Every yielded
+        Question renders the same prompt.
+        """
+        yield question
+        combos = product(*self._unused_values)
+        next(combos, None)  # the pinned combination is question itself
+        for combo in combos:
+            word_set = dict(question.word_set)
+            word_set.update(zip(self._unused_keys, combo))
+            yield Question(word_set, self.template, self.response_model)
+
     def __repr__(self) -> str:
         return f"QuestionSet(template={self.template}, word_sets={self.word_sets})"
     
+# Shared read-only fields mapping for answers that carry no structured fields.
+_EMPTY_FIELDS: Mapping[str, Any] = MappingProxyType({})
+
 @final
 class Answer:
+    __slots__ = ("word_set", "question_template", "question_value", "full_response", "fields", "error")
+
     # Fundamental attributes
-    word_set: dict
+    word_set: Dict[str, str]
     question_template:str
     question_value: str
     full_response: dict|None
-    fields: dict|None
-    error: Optional[str]|None
+    fields: Mapping[str, Any]
+    error: Optional[str]
 
-    def __init__(self, word_set: dict, question_template:str, question_value: str, full_response: dict|None, fields: dict|None):
+    def __init__(self, word_set: dict, question_template:str, question_value: str, full_response: dict|None, fields: Mapping[str, Any], error: Optional[str] = None):
         self.word_set = word_set
         self.question_template = question_template
         self.question_value = question_value
         self.full_response = full_response
-        self.fields = fields or {}
-        self.error = None
+        self.fields = fields
+        self.error = error
+
+    @staticmethod
+    def from_question_bare(question: Question, full_response: Dict[str,Any]|None, error: Optional[str] = None) -> 'Answer':
+        """Answer without structured fields, e.g. for a failed query."""
+        return Answer(question.word_set, question.template, question.value, full_response, _EMPTY_FIELDS, error)
+
+    @staticmethod
+    def from_question_with_fields(question: Question, full_response: Dict[str,Any]|None, fields: Mapping[str,Any]) -> 'Answer':
+        """Answer carrying the fields extracted from a successful response."""
+        return Answer(question.word_set, question.template, question.value, full_response, fields)
 
     @staticmethod
-    def from_question(question:Question, full_response:Dict[str,Any]|None, fields: Dict[str,Any]|None) -> 'Answer':
-        if fields is None:
-            fields = {}
-        answer = Answer(
-            word_set=question.word_set,
-            question_template=question.template,
-            question_value=question.value,
-            full_response=full_response,
-            fields=fields
-        )
-        return answer
+    def from_question(question:Question, full_response:Dict[str,Any]|None, fields: Mapping[str,Any]|None) -> 'Answer':
+        if not fields:
+            return Answer.from_question_bare(question, full_response)
+        return Answer.from_question_with_fields(question, full_response, fields)
     
     @property
-    def flattened(self) -> pd.DataFrame:
+    def flattened(self) -> 'pd.DataFrame':
+        return Answer.flatten_many([self])
+
+    def _flat_row(self) -> Dict[str, Any]:
         data = {
             'question': self.question_value,
             'error': self.error
         }
         if not self.error:
             assert self.full_response is not None
-            assert self.fields is not None
             data.update(self.word_set)
             data.update(self.fields)
-        df = pd.DataFrame([data])
-        return df
+        return data
+
+    @staticmethod
+    def flatten_many(answers: List['Answer']) -> 'pd.DataFrame':
+        """Flatten many answers into one DataFrame, one row per answer.
+
+        Rows are gathered straight into columns, so pandas never transposes
+        a list of row dicts. Columns keep first-seen order and cells a row
+        lacks are NaN, as with pd.DataFrame(list_of_dicts).
+        """
+        import numpy as np
+        import pandas as pd
+
+        columns: Dict[str, List[Any]] = {}
+        for n, answer in enumerate(answers):
+            row = answer._flat_row()
+            for key, column in columns.items():
+                column.append(row.pop(key, np.nan))
+            for key, value in row.items():
+                columns[key] = [np.nan] * n + [value]
+        return pd.DataFrame(columns)
 
     def __repr__(self) -> str:
         short_response = str(self.full_response)[:80] + "..." if self.full_response else None
-        return f"Answer(question='{self.question_value}', word_set={self.word_set}, fields={self.fields}, error={self.error}, full_response={short_response})"
+        return f"Answer(question='{self.question_value}', word_set={self.word_set}, fields={dict(self.fields)}, error={self.error}, full_response={short_response})"
 
 @final
 class QueryResponse:
-    full_response: Optional[Dict[str, Any]] = None
-    error: Optional[str] = None
+    __slots__ = ("full_response", "error", "retries", "_fields_cache")
+
+    full_response: Optional[Dict[str, Any]]
+    error: Optional[str]
+    # Number of retries the query handler needed before this response.
+    retries: int
+    # Fields extracted from full_response, filled in by the query handler
+    # that validated the content or else by the first Workflow.build_answer,
+    # so later answers for it skip re-parsing.
+    _fields_cache: Optional[Dict[str, Any]]
 
-    def __init__(self, full_response=None, error=None):
+    def __init__(self, full_response=None, error=None, retries=0):
         self.full_response = full_response
         self.error = error
+        self.retries = retries
+        self._fields_cache = None
 
     def __repr__(self) -> str:
-        return f"QueryResponse(full_response={self.full_response}, error={self.error})"
+        return f"QueryResponse(full_response={self.full_response}, error={self.error}, retries={self.retries})"
 
 
 class QueryHandler(ABC):
     async def query(self, prompt:str) -> QueryResponse:
         raise NotImplementedError()
+
+    async def query_batch(self, prompts: List[str]) -> List[QueryResponse]:
+        """Answer several prompts, one QueryResponse per prompt in order.
+
+        Handlers that can pack prompts into a single request override this;
+        the default simply issues one query per prompt.
+        """
+        return list(await asyncio.gather(*(self.query(prompt=p) for p in prompts)))
     
     def extract_fields(self, full_response:Dict[str,Any]) -> dict[str,Any]:
         raise NotImplementedError()
@@ -129,15 +277,49 @@ class StorageProvider(ABC):
     async def save_response(self, question:Question, response:QueryResponse) -> None:
         raise NotImplementedError()
 
+    async def save_responses_bulk(self, items: List[Tuple[Question, QueryResponse]]) -> None:
+        """Save several (question, response) pairs at once.
+
+        Providers should override this with a single write; the default
+        saves each pair in turn.
+        """
+        for question, response in items:
+            await self.save_response(question, response)
+
     @abstractmethod
     async def get_response(self, question: Question) -> QueryResponse:
         raise NotImplementedError()
 
+    async def get_response_valid(self, question: Question) -> bool:
+        """Whether a reusable (error-free) response is stored for question.
+
+        Providers that index the error state should override this so the
+        payload is not loaded just to find it cannot be reused.
+        """
+        response = await self.get_response(question)
+        return response is not None and not response.error
+
+    async def get_responses_bulk(self, questions: List[Question], valid_only: bool = False) -> List[Optional[QueryResponse]]:
+        """Look up several questions at once, returning responses in the same order.
+
+        Missing questions map to None, as do stored error responses when
+        valid_only is set. Providers should override this with a single
+        round-trip; the default issues one get_response per question
+        concurrently, so lookups against remote storage overlap.
+        """
+        if not questions:
+            return []
+        responses = await asyncio.gather(*(self.get_response(question) for question in questions))
+        if valid_only:
+            return [r if r is not None and not r.error else None for r in responses]
+        return list(responses)
+
     @abstractmethod
     async def delete_response(self, question: Question) -> None:
         raise NotImplementedError()
     
     @abstractmethod
-    async def get_stored_questions(self) -> AsyncIterable[Question]:
+    async def get_stored_questions(self, template: Optional[str] = None) -> AsyncIterable[Question]:
+        """Yield stored questions, only those for template when one is given."""
         raise NotImplementedError()
         yield cast(Question, None)
@@ -2,6 +2,8 @@
 
 from typing import Any, Dict, Type
 from pydantic import BaseModel, Field
+from robora import _json
+from robora.citations import enrich_citations
 from robora.classes import QueryHandler, QueryResponse
 
 
@@ -78,10 +80,9 @@ class MockQueryHandler(QueryHandler):
             return {}
         
         try:
-            import json
-            content_dict = json.loads(content_raw)
+            content_dict = _json.loads(content_raw)
             content = self.response_model.model_validate(content_dict)
-        except (json.JSONDecodeError, Exception):
+        except Exception:
             # Fallback to default values if parsing fails
             content = self.response_model(
                 relevance=2,
@@ -89,33 +90,7 @@ class MockQueryHandler(QueryHandler):
             )
             content_dict = content.model_dump()
         
-        # Enrich with citations similar to SonarQueryHandler
-        enriched_citations = []
-        citations = full_response.get('citations', [])
-        search_results = full_response.get('search_results', [])
-        search_lookup = {result.get('url', ''): result for result in search_results}
-        
-        for citation_url in citations:
-            enriched_citation = {
-                'url': citation_url,
-                'title': None,
-                'snippet': None,
-                'date': None,
-                'last_updated': None,
-                'matched': False
-            }
-            if citation_url in search_lookup:
-                search_result = search_lookup[citation_url]
-                enriched_citation.update({
-                    'title': search_result.get('title'),
-                    'snippet': search_result.get('snippet'),
-                    'date': search_result.get('date'),
-                    'last_updated': search_result.get('last_updated'),
-                    'matched': True
-                })
-            enriched_citations.append(enriched_citation)
-        
-        content_dict['enriched_citations'] = enriched_citations
+        content_dict['enriched_citations'] = enrich_citations(full_response)
         return content_dict
     
     def __repr__(self) -> str:
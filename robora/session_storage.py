@@ -1,49 +1,131 @@
 """Simple in-memory storage provider implementation."""
 
-from typing import Dict, Any, AsyncIterable
+from typing import Dict, Any, AsyncIterable, FrozenSet, Iterator, List, Mapping, Optional, Tuple
 from robora.classes import StorageProvider, Question, QueryResponse
 
+# Responses are indexed by template, then by the word_set contents (the
+# second half of Question.key), so everything stored for one template is a
+# single bucket. Question defines no __eq__, so keying on the Question
+# object itself would only match the exact instance that was saved.
+_WordSetKey = FrozenSet[Tuple[str, str]]
+
+
+class _ResponsesView(Mapping[Tuple[str, _WordSetKey], QueryResponse]):
+    """Read-only live view of stored responses, keyed like Question.key."""
+
+    __slots__ = ("_storage",)
+
+    def __init__(self, storage: Dict[str, Dict[_WordSetKey, Tuple[Question, QueryResponse]]]):
+        self._storage = storage
+
+    def __getitem__(self, key: Tuple[str, _WordSetKey]) -> QueryResponse:
+        template, word_set_key = key
+        return self._storage[template][word_set_key][1]
+
+    def __iter__(self) -> Iterator[Tuple[str, _WordSetKey]]:
+        for template, bucket in self._storage.items():
+            for word_set_key in bucket:
+                yield (template, word_set_key)
+
+    def __len__(self) -> int:
+        return sum(len(bucket) for bucket in self._storage.values())
+
 
 class SessionStorageProvider(StorageProvider):
     """Simple in-memory implementation of StorageProvider for demonstration purposes."""
     
     def __init__(self):
-        # In-memory storage using question string as key
-        self._storage: Dict[Question, QueryResponse] = {}
+        # Each entry is a single (question, response) tuple, so saving is one
+        # dict write and listing questions needs no separate index.
+        self._storage: Dict[str, Dict[_WordSetKey, Tuple[Question, QueryResponse]]] = {}
+        # Memoized count(); reset whenever entries are added or removed.
+        self._count_cache: Optional[int] = None
+
+    def _entry(self, question: Question) -> Optional[Tuple[Question, QueryResponse]]:
+        template, word_set_key = question.key
+        bucket = self._storage.get(template)
+        return bucket.get(word_set_key) if bucket is not None else None
     
     async def save_response(self, question: Question, response:QueryResponse) -> None:
         """Save a response to in-memory storage."""
-        self._storage[question] = response
+        template, word_set_key = question.key
+        bucket = self._storage.get(template)
+        if bucket is None:
+            bucket = self._storage[template] = {}
+        bucket[word_set_key] = (question, response)
+        self._count_cache = None
+
+    async def save_responses_bulk(self, items: List[Tuple[Question, QueryResponse]]) -> None:
+        """Save several responses to in-memory storage in one pass."""
+        storage = self._storage
+        for question, response in items:
+            template, word_set_key = question.key
+            bucket = storage.get(template)
+            if bucket is None:
+                bucket = storage[template] = {}
+            bucket[word_set_key] = (question, response)
+        self._count_cache = None
     
     async def get_response(self, question: Question) -> QueryResponse|None:
         """Retrieve a response from in-memory storage."""
-        response = self._storage.get(question)
+        entry = self._entry(question)
         
-        if response is None:
+        if entry is None:
             return None
         
-        # Return a string representation of the stored response
-        return response
-    
+        return entry[1]
+
+    async def get_response_valid(self, question: Question) -> bool:
+        """Whether an error-free response is stored in memory for question."""
+        entry = self._entry(question)
+        return entry is not None and not entry[1].error
+
+    async def get_responses_bulk(self, questions: List[Question], valid_only: bool = False) -> List[Optional[QueryResponse]]:
+        """Retrieve several responses from in-memory storage in one pass."""
+        entries = [self._entry(question) for question in questions]
+        if valid_only:
+            return [entry[1] if entry is not None and not entry[1].error else None for entry in entries]
+        return [entry[1] if entry is not None else None for entry in entries]
+
     async def delete_response(self, question: Question) -> None:
         """Delete a response from in-memory storage."""
-        if question in self._storage:
-            del self._storage[question]
+        template, word_set_key = question.key
+        bucket = self._storage.get(template)
+        if bucket is not None and bucket.pop(word_set_key, None) is not None:
+            if not bucket:
+                del self._storage[template]
+            self._count_cache = None
 
-    async def get_stored_questions(self) -> AsyncIterable[Question]:
-        for question in self._storage.keys():
-            yield question
+    async def get_stored_questions(self, template: Optional[str] = None) -> AsyncIterable[Question]:
+        if template is not None:
+            buckets = [self._storage.get(template, {})]
+        else:
+            buckets = list(self._storage.values())
+        for bucket in buckets:
+            for question, _ in list(bucket.values()):
+                yield question
     
+    def get_all_responses(self) -> Mapping[Tuple[str, _WordSetKey], QueryResponse]:
+        """Return a read-only view of every stored response, keyed by Question.key.
+
+        The view reflects later saves and deletes; copy it with dict() to
+        keep a snapshot.
+        """
+        return _ResponsesView(self._storage)
+
     def clear(self) -> None:
         """Clear all stored responses."""
         self._storage.clear()
+        self._count_cache = None
     
     def count(self) -> int:
         """Return the number of stored responses."""
-        return len(self._storage)
+        if self._count_cache is None:
+            self._count_cache = sum(len(bucket) for bucket in self._storage.values())
+        return self._count_cache
     
     def __repr__(self) -> str:
-        return f"SessionStorageProvider(stored_responses={len(self._storage)})"
+        return f"SessionStorageProvider(stored_responses={self.count()})"
     
     def __str__(self) -> str:
-        return f"SessionStorageProvider with {len(self._storage)} stored responses"
\ No newline at end of file
+        return f"SessionStorageProvider with {self.count()} stored responses"
\ No newline at end of file
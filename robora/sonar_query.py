@@ -1,101 +1,317 @@
-from typing import Any, Dict, List, Optional, Type, Union
+from typing import Any, Dict, List, Optional, Tuple, Type
 import httpx
-import json
 import asyncio
-from pydantic import BaseModel, ValidationError
+import importlib.util
+import logging
+import random
+from pydantic import BaseModel, ValidationError, create_model
 
+from robora import _json
 from robora.CONFIG import PERPLEXITY_API_KEY
 
-from collections import namedtuple
+from robora.citations import enrich_citations
 from robora.classes import QueryHandler, QueryResponse
 
+logger = logging.getLogger(__name__)
+
+PROMPT_TEMPLATE = "{prompt}\n\nPlease provide comprehensive information and format your response according to the specified JSON schema structure. Pay attention to the field descriptions in the schema to understand what information is expected for each field.\n\nJSON Schema:\n{schema_json}"
+
+API_URL = "https://api.perplexity.ai/chat/completions"
+
+# Upper bound in seconds on the wait before any retry, whether it comes
+# from the exponential backoff or from a Retry-After header.
+MAX_RETRY_DELAY = 60.0
+
+# HTTP/2 needs the optional ``h2`` package (``pip install httpx[http2]``).
+# Without it the client stays on HTTP/1.1 and only the keep-alive pool helps.
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Per-model (schema, pretty-printed schema) pairs, and the runtime
+# {"items": [...]} wrapper models used by query_batch. Both depend only on
+# the model class, so they are built once rather than on every request.
+_SCHEMA_CACHE: Dict[Type[BaseModel], Tuple[Dict[str, Any], str]] = {}
+_BATCH_MODEL_CACHE: Dict[Type[BaseModel], Type[BaseModel]] = {}
+
+
+def _schema_for(response_model: Type[BaseModel]) -> Tuple[Dict[str, Any], str]:
+    cached = _SCHEMA_CACHE.get(response_model)
+    if cached is None:
+        schema = response_model.model_json_schema()
+        cached = _SCHEMA_CACHE[response_model] = (schema, _json.dumps_pretty(schema))
+    return cached
+
+
+def _batch_model_for(response_model: Type[BaseModel]) -> Type[BaseModel]:
+    batch_model = _BATCH_MODEL_CACHE.get(response_model)
+    if batch_model is None:
+        batch_model = _BATCH_MODEL_CACHE[response_model] = create_model('Batch', items=(List[response_model], ...))
+    return batch_model
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds from a Retry-After header; None when absent or an HTTP date."""
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        return None
+
+
 class SonarQueryHandler(QueryHandler):
     response_model: Type[BaseModel]
     model: str = "sonar"
     max_retries: int = 3
-    def __init__(self, response_model: Type[BaseModel], model: str = "sonar", max_retries: int = 3, ):
+    retry_delay: float = 1.0
+    trust_schema: bool = False
+    requests_per_minute: Optional[float] = None
+    def __init__(self, response_model: Type[BaseModel], model: str = "sonar", max_retries: int = 3, trust_schema: bool = False, retry_delay: float = 1.0, transport: Optional[httpx.AsyncBaseTransport] = None, requests_per_minute: Optional[float] = None):
+        if requests_per_minute is not None and requests_per_minute <= 0:
+            raise ValueError("requests_per_minute must be positive")
         self.response_model = response_model
         self.model = model
         self.max_retries = max_retries
+        self.trust_schema = trust_schema
+        self.retry_delay = retry_delay
+        # Requests (retries included) are spaced to stay under the API's
+        # rate limit up front, rather than sending and backing off on 429.
+        self.requests_per_minute = requests_per_minute
+        self._next_request_at = 0.0
+        self._headers = {
+            "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
+            "Content-Type": "application/json"
+        }
+        # Custom transport for the pooled client, e.g. httpx.MockTransport in tests.
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        """Return the pooled client, creating it on first use.
+
+        Reusing one client keeps connections (and their TLS sessions) alive
+        across requests. Connections are bound to the event loop that opened
+        them, so a new client is made when called from a different loop and
+        the old one is closed.
+        When h2 is installed, concurrent requests are multiplexed over HTTP/2;
+        the server may still negotiate HTTP/1.1 via ALPN.
+        """
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._client_loop is not loop:
+            # Swapped in before awaiting the close, so concurrent callers
+            # share the new client instead of each making one.
+            stale, self._client = self._client, httpx.AsyncClient(
+                http2=_HTTP2_AVAILABLE,
+                timeout=60.0,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+                transport=self._transport,
+            )
+            self._client_loop = loop
+            if stale is not None and not stale.is_closed:
+                try:
+                    await stale.aclose()
+                except Exception as e:
+                    # Its loop may already be closed; the sockets are then
+                    # released when the client is garbage collected.
+                    logger.debug("Could not close client from previous event loop: %s", e)
+        return self._client
+
+    async def _pace(self) -> None:
+        """Wait for this request's slot under requests_per_minute.
+
+        Each caller reserves the next free slot before sleeping, so
+        concurrent requests queue up evenly spaced instead of waking
+        together.
+        """
+        if self.requests_per_minute is None:
+            return
+        now = asyncio.get_running_loop().time()
+        start = max(now, self._next_request_at)
+        self._next_request_at = start + 60.0 / self.requests_per_minute
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def _retry_wait(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait before retry number ``attempt`` (1 for the first).
+
+        The delay doubles from retry_delay on each attempt, capped at
+        MAX_RETRY_DELAY, and a random half of it is jittered so concurrent
+        callers that failed together do not retry together. A Retry-After
+        from the server is honoured when it asks for longer.
+        """
+        delay = min(self.retry_delay * 2 ** (attempt - 1), MAX_RETRY_DELAY)
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, MAX_RETRY_DELAY))
+        return delay
+
+    async def aclose(self) -> None:
+        """Close the pooled HTTP client."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._client_loop = None
     
     async def query(self, prompt:str) -> QueryResponse:
-        schema = self.response_model.model_json_schema()
-        enhanced_prompt = f"""{prompt}\n\nPlease provide comprehensive information and format your response according to the specified JSON schema structure. Pay attention to the field descriptions in the schema to understand what information is expected for each field.\n\nJSON Schema:\n{json.dumps(schema, indent=2)}"""
-        try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
+        schema, schema_json = _schema_for(self.response_model)
+        response, content = await self._post(PROMPT_TEMPLATE.format(prompt=prompt, schema_json=schema_json), schema, self.response_model)
+        if content is not None:
+            assert response.full_response is not None
+            response._fields_cache = self._fields(content, response.full_response)
+        return response
+
+    async def query_batch(self, prompts: List[str]) -> List[QueryResponse]:
+        """Pack several prompts into one request and split the answers back out.
+
+        The response schema is wrapped as ``{"items": [response_model, ...]}``
+        and each returned item becomes its own QueryResponse, shaped like a
+        single-prompt response so ``extract_fields`` works unchanged.
+
+        The API returns one set of citations for the whole request, which
+        cannot be attributed to individual answers. Each item therefore keeps
+        them under ``batch_citations`` and ``batch_search_results`` rather
+        than ``citations`` and ``search_results``, so its
+        ``enriched_citations`` is empty instead of listing other questions'
+        sources. If the reply holds the wrong number of items, each prompt is
+        asked on its own instead.
+        """
+        if len(prompts) == 1:
+            return [await self.query(prompts[0])]
+
+        batch_model = _batch_model_for(self.response_model)
+        schema, schema_json = _schema_for(batch_model)
+        numbered = "\n---\n".join(f"{i}. {p}" for i, p in enumerate(prompts, 1))
+        batch_prompt = (
+            f"Answer each of the following {len(prompts)} questions independently. "
+            f"Return a JSON object whose \"items\" array holds exactly {len(prompts)} answers, "
+            f"one per question, in the same order as the questions.\n\n{numbered}"
+        )
+        response, content = await self._post(PROMPT_TEMPLATE.format(prompt=batch_prompt, schema_json=schema_json), schema, batch_model)
+        if content is None:
+            return [QueryResponse(full_response=None, error=response.error, retries=response.retries) for _ in prompts]
+
+        # content is the runtime Batch model built by _batch_model_for.
+        validated_items = getattr(content, 'items')
+        if len(validated_items) != len(prompts):
+            # The answers cannot be matched to their prompts.
+            return list(await asyncio.gather(*(self.query(p) for p in prompts)))
+
+        full_response = response.full_response
+        assert full_response is not None
+        choice = full_response['choices'][0]
+        items = _json.loads(choice['message']['content'])['items']
+        shared = {key: value for key, value in full_response.items() if key not in ('choices', 'citations', 'search_results')}
+        if 'citations' in full_response:
+            shared['batch_citations'] = full_response['citations']
+        if 'search_results' in full_response:
+            shared['batch_search_results'] = full_response['search_results']
+
+        responses = []
+        for item, validated in zip(items, validated_items):
+            item_full_response = {
+                **shared,
+                'choices': [{**choice, 'message': {**choice['message'], 'content': _json.dumps(item)}}],
+            }
+            item_response = QueryResponse(full_response=item_full_response, error=None, retries=response.retries)
+            item_response._fields_cache = self._fields(validated, item_full_response)
+            responses.append(item_response)
+        return responses
+
+    async def _post(self, enhanced_prompt: str, schema: Dict[str, Any], response_model: Type[BaseModel]) -> Tuple[QueryResponse, Optional[BaseModel]]:
+        """Send the prompt, retrying until the content validates against response_model.
+
+        When the content fails validation, the next attempt includes the
+        previous output and the validation error so the model can correct
+        it instead of starting over. Returns the response and, on success,
+        the validated content.
+        """
+        messages = [{'role': 'user', 'content': enhanced_prompt}]
+        error = None
+        retry_after = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self._retry_wait(attempt, retry_after))
+                retry_after = None
+            await self._pace()
+            try:
+                client = await self._get_client()
                 response = await client.post(
-                    "https://api.perplexity.ai/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-                        "Content-Type": "application/json"
-                    },
-                    json = {
+                    API_URL,
+                    headers=self._headers,
+                    content = _json.dumps_bytes({
                         'model': self.model,
-                        'messages': [
-                            {
-                                'role': 'user',
-                                'content': enhanced_prompt
-                            }
-                        ],
+                        'messages': messages,
                         'response_format': {
                             'type': 'json_schema',
                             'json_schema': {
                                 'schema': schema
                             }
                         }
-                    }
+                    })
                 )
                 response.raise_for_status()
                 if not response.content:
                     raise ValueError("Empty response from API")
-                full_response = response.json()
-                return QueryResponse(full_response=full_response, error=None)
-        except Exception as e:
-            return QueryResponse(full_response=None, error=str(e))
-    
-    def extract_fields(self, full_response: Dict[str,Any]) -> dict[str,Any]:
+                full_response = _json.loads(response.content)
+            except httpx.HTTPStatusError as e:
+                error = str(e)
+                # Client errors other than rate limiting will not succeed on retry.
+                if e.response.status_code < 500 and e.response.status_code != 429:
+                    return QueryResponse(full_response=None, error=error, retries=attempt), None
+                retry_after = _parse_retry_after(e.response.headers.get("Retry-After"))
+                continue
+            except Exception as e:
+                error = str(e)
+                continue
+
+            content = full_response.get('choices', [{}])[0].get('message', {}).get('content', '')
+            try:
+                if not content:
+                    raise ValueError("Empty content in API response")
+                # Parse and validate in one pass inside pydantic-core.
+                validated = response_model.model_validate_json(content)
+            except (ValidationError, ValueError) as e:
+                error = str(e)
+                messages = [
+                    messages[0],
+                    {'role': 'assistant', 'content': content},
+                    {'role': 'user', 'content': f"Your previous output failed validation: {e}. Return corrected JSON matching the schema."},
+                ]
+                continue
+            return QueryResponse(full_response=full_response, error=None, retries=attempt), validated
+
+        return QueryResponse(full_response=None, error=error, retries=self.max_retries), None
+
+    @staticmethod
+    def _fields(content: BaseModel, full_response: Dict[str, Any]) -> Dict[str, Any]:
+        """Fields for already-validated content, as extract_fields returns them."""
+        content_dict = content.model_dump()
+        content_dict['enriched_citations'] = enrich_citations(full_response)
+        return content_dict
 
+    def extract_fields(self, full_response: Dict[str,Any]) -> dict[str,Any]:
+        # Responses from query() arrive with their fields already filled in
+        # from the content it validated, so this mostly runs for responses
+        # read back from storage or the response cache. Those may predate
+        # the current response model, so they are validated here.
         content_raw = full_response.get('choices', [{}])[0].get('message', {}).get('content', '')
         if not content_raw:
             raise ValueError("Empty content in API response")
-        content_dict = json.loads(content_raw)
-        content = self.response_model.model_validate(content_dict)
-
-        # Enrich with citations
-        enriched_citations = []
-        assert(type(full_response) == dict)
-        citations = full_response.get('citations', [])
-        search_results = full_response.get('search_results', [])
-        search_lookup = {result.get('url', ''): result for result in search_results}
-        for citation_url in citations:
-            enriched_citation = {
-                'url': citation_url,
-                'title': None,
-                'snippet': None,
-                'date': None,
-                'last_updated': None,
-                'matched': False
-            }
-            if citation_url in search_lookup:
-                search_result = search_lookup[citation_url]
-                enriched_citation.update({
-                    'title': search_result.get('title'),
-                    'snippet': search_result.get('snippet'),
-                    'date': search_result.get('date'),
-                    'last_updated': search_result.get('last_updated'),
-                    'matched': True
-                })
-            enriched_citations.append(enriched_citation)
-
-        # 
-        content_dict = content.model_dump()
-        content_dict['enriched_citations'] = enriched_citations
-        return content_dict
+        if self.trust_schema:
+            # Opt-in trust boundary for stores known to hold only content
+            # validated against this response model: model_construct fills
+            # defaults without validating, and enum or nested-model fields
+            # stay as plain JSON values.
+            content_dict = dict(self.response_model.model_construct(**_json.loads(content_raw)))
+            content_dict['enriched_citations'] = enrich_citations(full_response)
+            return content_dict
+        return self._fields(self.response_model.model_validate_json(content_raw), full_response)
         
     def __repr__(self) -> str:
         return (
             f"{self.__class__.__name__}(response_model={self.response_model.__name__}, "
-            f"model='{self.model}', max_retries={self.max_retries})"
+            f"model='{self.model}', max_retries={self.max_retries}, retry_delay={self.retry_delay}, "
+            f"trust_schema={self.trust_schema}, requests_per_minute={self.requests_per_minute})"
         )
 
     def __str__(self) -> str:
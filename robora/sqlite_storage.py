@@ -1,12 +1,31 @@
 """SQLite-based storage provider implementation."""
 
 import sqlite3
-import json
 import asyncio
-from typing import Dict, Any, AsyncIterable, Optional
+import logging
+import threading
+from typing import Dict, Any, AsyncIterable, List, Optional, Tuple
 from pathlib import Path
+from robora import _json
 from robora.classes import StorageProvider, Question, QueryResponse
 
+logger = logging.getLogger(__name__)
+
+# Questions per SELECT ... IN (...) in get_responses_bulk; older SQLite
+# builds cap a statement at 999 bound parameters.
+_BULK_CHUNK = 500
+
+# Per-row statements, kept as constants so each call passes the identical
+# text and the connection's statement cache reuses the compiled statement.
+_INSERT_SQL = """
+    INSERT OR REPLACE INTO question_responses
+    (question_hash, question_json, response_json, has_error)
+    VALUES (?, ?, ?, ?)
+"""
+_SELECT_RESPONSE_SQL = "SELECT question_json, response_json FROM question_responses WHERE question_hash = ?"
+_SELECT_VALID_SQL = "SELECT question_json FROM question_responses WHERE question_hash = ? AND has_error = 0"
+_DELETE_SQL = "DELETE FROM question_responses WHERE question_hash = ?"
+
 
 class SQLiteStorageProvider(StorageProvider):
     """SQLite-based implementation of StorageProvider for persistent storage."""
@@ -19,46 +38,83 @@ class SQLiteStorageProvider(StorageProvider):
             db_path: Path to SQLite database file. Defaults to "robora.db"
         """
         self.db_path = Path(db_path)
+        # One connection per provider, opened once and shared by every
+        # operation. Operations run on executor threads, so the lock keeps
+        # them from interleaving on the connection.
+        self._conn = self._connect()
+        self._lock = threading.Lock()
+        # Saves waiting to be written, in call order, and the task writing them.
+        self._pending_saves: List[Tuple[List[Tuple[int, str, str, int]], asyncio.Future]] = []
+        self._flushing: Optional[asyncio.Task] = None
         # initialize DB schema if needed
         self._init_database()
-        # load existing DB state into memory (e.g., known question hashes)
-        self._load_database()
 
-    def _load_database(self) -> None:
-        """Load lightweight DB state into memory on initialization.
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database with WAL journaling and tuned pragmas.
 
-        Currently we load the set of stored question_hash values so callers can
-        quickly check presence without a round-trip for common operations.
+        WAL lets readers in other connections or processes proceed while
+        this one writes, and synchronous=NORMAL syncs at checkpoints rather
+        than on every commit. journal_mode is stored in the file; the other
+        pragmas apply to this connection only.
         """
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.execute("SELECT question_hash FROM question_responses")
-                rows = cursor.fetchall()
-        except Exception:
-            # If DB cannot be read for any reason, initialize empty state.
-            rows = []
-
-        # Store a set of known question_hash values in memory.
-        self._question_hashes = {row[0] for row in rows} if rows else set()
-        self._loaded = True
-        print(f"Loaded {len(self._question_hashes)} stored question hashes from {self.db_path}")
-    
+        conn = sqlite3.connect(self.db_path, timeout=5.0, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-64000")
+        return conn
+
+    def close(self) -> None:
+        """Close the connection; the provider cannot be used afterwards.
+
+        Closing the last connection to the file checkpoints the WAL and
+        removes the -wal and -shm files next to the database.
+        """
+        with self._lock:
+            self._conn.close()
+
     def _init_database(self) -> None:
         """Initialize the SQLite database and create tables if they don't exist."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._lock, self._conn as conn:
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS question_responses (
                     question_hash INTEGER PRIMARY KEY,
                     question_json TEXT NOT NULL,
                     response_json TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    has_error INTEGER NOT NULL DEFAULT 0
                 )
             """)
+            # Databases created before has_error existed get the column
+            # added and backfilled from the stored responses.
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(question_responses)")}
+            if "has_error" not in columns:
+                conn.execute("ALTER TABLE question_responses ADD COLUMN has_error INTEGER NOT NULL DEFAULT 0")
+                conn.execute("""
+                    UPDATE question_responses
+                    SET has_error = COALESCE(json_extract(response_json, '$.error'), '') != ''
+                """)
+            # Schema version 1 keys rows by Question.fingerprint. Earlier
+            # databases used hash(question), which changes between processes,
+            # so their rows are rekeyed (newest wins on duplicates).
+            if conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+                rows = conn.execute("""
+                    SELECT question_hash, question_json FROM question_responses
+                    ORDER BY created_at
+                """).fetchall()
+                for old_hash, question_json in rows:
+                    data = _json.loads(question_json)
+                    fingerprint = Question(data["word_set"], data["template"], None).fingerprint
+                    conn.execute(
+                        "UPDATE OR REPLACE question_responses SET question_hash = ? WHERE question_hash = ?",
+                        (fingerprint, old_hash)
+                    )
+                conn.execute("PRAGMA user_version = 1")
             conn.commit()
     
     def _serialize_question(self, question: Question) -> str:
         """Serialize a Question object to JSON string."""
-        return json.dumps({
+        return _json.dumps({
             "word_set": question.word_set,
             "template": question.template,
             "response_model": question.response_model.__name__ if question.response_model else None
@@ -66,7 +122,7 @@ class SQLiteStorageProvider(StorageProvider):
     
     def _deserialize_question(self, question_json: str, response_model_name: Optional[str] = None) -> Question:
         """Deserialize a Question object from JSON string."""
-        data = json.loads(question_json)
+        data = _json.loads(question_json)
         # Note: We can't fully reconstruct the response_model from just the name
         # For now, we'll set it to None and let the calling code handle it
         return Question(
@@ -75,77 +131,190 @@ class SQLiteStorageProvider(StorageProvider):
             response_model=None  # This will need to be handled by the caller
         )
     
+    @staticmethod
+    def _matches(question: Question, question_json: str) -> bool:
+        """Whether a stored row belongs to question rather than a fingerprint collision."""
+        data = _json.loads(question_json)
+        return data["template"] == question.template and data["word_set"] == question.word_set
+
     def _serialize_response(self, response: QueryResponse) -> str:
         """Serialize a QueryResponse object to JSON string."""
-        return json.dumps({
+        return _json.dumps({
             "full_response": response.full_response,
-            "error": response.error
+            "error": response.error,
+            "retries": response.retries
         })
     
     def _deserialize_response(self, response_json: str) -> QueryResponse:
         """Deserialize a QueryResponse object from JSON string."""
-        data = json.loads(response_json)
+        data = _json.loads(response_json)
         return QueryResponse(
             full_response=data["full_response"],
-            error=data["error"]
+            error=data["error"],
+            retries=data.get("retries", 0)
         )
     
+    def _write_rows(self, rows: List[Tuple[int, str, str, int]]) -> None:
+        """Insert or replace rows in one transaction; runs on an executor thread."""
+        # All rows go in one BEGIN IMMEDIATE ... COMMIT, so the batch costs
+        # one journal sync and holds the write lock from the start.
+        with self._lock, self._conn as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(_INSERT_SQL, rows)
+            conn.commit()
+
     async def save_response(self, question: Question, response: QueryResponse) -> None:
-        """Save a response to SQLite storage."""
-        # Run database operations in a thread to avoid blocking the event loop
-        def _save():
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute("""
-                    INSERT OR REPLACE INTO question_responses 
-                    (question_hash, question_json, response_json)
-                    VALUES (?, ?, ?)
-                """, (
-                    hash(question),
-                    self._serialize_question(question),
-                    self._serialize_response(response)
-                ))
-                conn.commit()
-        
-        await asyncio.get_event_loop().run_in_executor(None, _save)
+        """Save a response to SQLite storage.
+
+        Saves are group-committed: those made while an earlier write is in
+        progress (or in the same event loop turn) are queued and written
+        together in the next transaction. Each call still returns only
+        once its own row is committed.
+        """
+        await self._enqueue([(
+            question.fingerprint,
+            self._serialize_question(question),
+            self._serialize_response(response),
+            1 if response.error else 0
+        )])
+
+    async def _enqueue(self, rows: List[Tuple[int, str, str, int]]) -> None:
+        """Queue rows for the next group commit and wait until they are written."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending_saves.append((rows, future))
+        if self._flushing is None:
+            self._flushing = loop.create_task(self._flush_saves())
+        await future
+
+    async def _flush_saves(self) -> None:
+        """Write queued saves until none are left, one transaction per batch."""
+        loop = asyncio.get_running_loop()
+        try:
+            while self._pending_saves:
+                batch, self._pending_saves = self._pending_saves, []
+                try:
+                    rows = [row for entry, _ in batch for row in entry]
+                    await loop.run_in_executor(None, self._write_rows, rows)
+                except asyncio.CancelledError:
+                    for _, future in batch + self._pending_saves:
+                        future.cancel()
+                    self._pending_saves = []
+                    raise
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for _, future in batch:
+                    # A caller that was cancelled no longer waits for its row.
+                    if not future.done():
+                        future.set_result(None)
+        finally:
+            self._flushing = None
+
+    async def save_responses_bulk(self, items: List[Tuple[Question, QueryResponse]]) -> None:
+        """Save several responses to SQLite storage in one transaction."""
+        if not items:
+            return
+        # Broadcast saves repeat one response object for many questions, so
+        # each distinct response is serialized once. id() is stable here
+        # because items keeps every response alive for the whole call.
+        response_json: Dict[int, str] = {}
+        rows = []
+        for question, response in items:
+            serialized = response_json.get(id(response))
+            if serialized is None:
+                serialized = response_json[id(response)] = self._serialize_response(response)
+            rows.append((
+                question.fingerprint,
+                self._serialize_question(question),
+                serialized,
+                1 if response.error else 0
+            ))
+
+        # Queued with save_response calls so rows land in call order and an
+        # older queued save cannot overwrite this one.
+        await self._enqueue(rows)
     
     async def get_response(self, question: Question) -> QueryResponse | None:
         """Retrieve a response from SQLite storage."""
         def _get():
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.execute("""
-                    SELECT response_json FROM question_responses 
-                    WHERE question_hash = ?
-                """, (hash(question),))
-                row = cursor.fetchone()
-                return row[0] if row else None
+            with self._lock, self._conn as conn:
+                cursor = conn.execute(_SELECT_RESPONSE_SQL, (question.fingerprint,))
+                return cursor.fetchone()
         
-        response_json = await asyncio.get_event_loop().run_in_executor(None, _get)
+        row = await asyncio.get_event_loop().run_in_executor(None, _get)
         
-        if response_json is None:
+        if row is None or not self._matches(question, row[0]):
             return None
         
-        return self._deserialize_response(response_json)
+        return self._deserialize_response(row[1])
     
+    async def get_response_valid(self, question: Question) -> bool:
+        """Whether an error-free response is stored, without loading it."""
+        def _valid():
+            with self._lock, self._conn as conn:
+                cursor = conn.execute(_SELECT_VALID_SQL, (question.fingerprint,))
+                return cursor.fetchone()
+
+        row = await asyncio.get_event_loop().run_in_executor(None, _valid)
+        return row is not None and self._matches(question, row[0])
+
+    async def get_responses_bulk(self, questions: List[Question], valid_only: bool = False) -> List[Optional[QueryResponse]]:
+        """Retrieve several responses from SQLite storage with one connection."""
+        hashes = [question.fingerprint for question in questions]
+        # Error rows are filtered in SQL so their payloads are never read.
+        condition = " AND has_error = 0" if valid_only else ""
+
+        def _get_bulk():
+            found: Dict[int, Tuple[str, str]] = {}
+            with self._lock, self._conn as conn:
+                # Chunked to stay under SQLite's bound-parameter limit.
+                for start in range(0, len(hashes), _BULK_CHUNK):
+                    chunk = hashes[start:start + _BULK_CHUNK]
+                    placeholders = ",".join("?" * len(chunk))
+                    cursor = conn.execute(f"""
+                        SELECT question_hash, question_json, response_json FROM question_responses
+                        WHERE question_hash IN ({placeholders}){condition}
+                    """, chunk)
+                    found.update((h, (q, r)) for h, q, r in cursor)
+            return found
+
+        found = await asyncio.get_event_loop().run_in_executor(None, _get_bulk)
+        results: List[Optional[QueryResponse]] = []
+        for question in questions:
+            row = found.get(question.fingerprint)
+            if row is None or not self._matches(question, row[0]):
+                results.append(None)
+            else:
+                results.append(self._deserialize_response(row[1]))
+        return results
+
     async def delete_response(self, question: Question) -> None:
         """Delete a response from SQLite storage."""
         def _delete():
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute("""
-                    DELETE FROM question_responses 
-                    WHERE question_hash = ?
-                """, (hash(question),))
+            with self._lock, self._conn as conn:
+                conn.execute(_DELETE_SQL, (question.fingerprint,))
                 conn.commit()
         
         await asyncio.get_event_loop().run_in_executor(None, _delete)
     
-    async def get_stored_questions(self) -> AsyncIterable[Question]:
-        """Retrieve all stored questions from SQLite storage."""
+    async def get_stored_questions(self, template: Optional[str] = None) -> AsyncIterable[Question]:
+        """Retrieve stored questions from SQLite storage, optionally for one template."""
         def _get_all():
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.execute("""
-                    SELECT question_json FROM question_responses
-                    ORDER BY created_at
-                """)
+            with self._lock, self._conn as conn:
+                if template is None:
+                    cursor = conn.execute("""
+                        SELECT question_json FROM question_responses
+                        ORDER BY created_at
+                    """)
+                else:
+                    cursor = conn.execute("""
+                        SELECT question_json FROM question_responses
+                        WHERE json_extract(question_json, '$.template') = ?
+                        ORDER BY created_at
+                    """, (template,))
                 return cursor.fetchall()
         
         rows = await asyncio.get_event_loop().run_in_executor(None, _get_all)
@@ -157,13 +326,13 @@ class SQLiteStorageProvider(StorageProvider):
     
     def clear(self) -> None:
         """Clear all stored responses."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._lock, self._conn as conn:
             conn.execute("DELETE FROM question_responses")
             conn.commit()
     
     def count(self) -> int:
         """Return the number of stored responses."""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._lock, self._conn as conn:
             cursor = conn.execute("SELECT COUNT(*) FROM question_responses")
             return cursor.fetchone()[0]
     
@@ -3,106 +3,434 @@ from typing import Optional
 # from robora.storage import QueryStorage  # Commented out since it doesn't exist
 from pydantic import BaseModel
 from string import Template
-from typing import Type, List, Dict, Any, Callable, AsyncIterable, Optional
+from typing import Type, List, Dict, Any, Callable, AsyncIterable, Optional, Tuple, cast
 from abc import ABC
+from robora import _json
 from robora.classes import Answer, StorageProvider, QueryHandler, Question, QuestionSet, QueryResponse
+from robora.cache import ResponseCache, response_cache_key
+from pathlib import Path
 
 from typing import final
 import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Stands in for a missing stored response in build_answer. It is only read,
+# never modified, so one shared instance serves every such answer.
+_NO_RESPONSE = QueryResponse(error="No response")
 
 @final
 class Workflow:
-    def __init__(self, query_handler:QueryHandler, storage: StorageProvider, workers=2):
+    def __init__(self, query_handler:QueryHandler, storage: StorageProvider, workers=2, batch_size=1, cache_dir: Optional[Path]=None):
+        # Checked here, not when asking: ask_multiple with no workers would
+        # wait forever, and an empty batch would never advance.
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
         self.storage = storage
         self.query_handler = query_handler
         self.max_workers = workers
+        # Number of questions sent to the query handler per request; see
+        # QueryHandler.query_batch. 1 keeps one request per question.
+        self.batch_size = batch_size
+        # Optional on-disk cache of raw responses keyed by provider, model,
+        # prompt and schema; consulted before any query is sent.
+        self.response_cache = ResponseCache(cache_dir) if cache_dir is not None else None
+        # Prompt -> future for queries currently being sent, so concurrent
+        # callers asking the same prompt share one request.
+        self._inflight: Dict[str, asyncio.Future] = {}
 
     async def ask(self, question: Question, overwrite:bool = False) -> Answer:
         response = None
         
-        if not overwrite:
+        # Only load the stored payload when it can actually be reused.
+        if not overwrite and await self.storage.get_response_valid(question):
             response = await self.storage.get_response(question)
-            if response is not None:
-                print("Found cached response")
-                if response.error:
-                    print("Cached response has error, flushing:", response.error)
-                    response = None
-                else:
-                    print("Using cached response")
-                    print(response)
+            logger.debug("Using cached response for %s", question.value)
 
         # If no cached response, query
         if response is None:
-            prompt = question.value
-            response = await self.query_handler.query(prompt=prompt)
-            assert response is not None
-            assert isinstance(response, QueryResponse)
-            await self.storage.save_response(question, response)
+            [response] = await self._fetch([question], overwrite=overwrite)
 
         answer = self.build_answer(question, response)
         return answer
 
-    async def ask_multiple_stream(self, question_set: QuestionSet, overwrite:bool=False):
-        semaphore = asyncio.Semaphore(self.max_workers)
+    async def ask_batch(self, questions: List[Question], overwrite:bool = False) -> List[Answer]:
+        """Answer several questions, sending all uncached ones in a single query_batch call."""
+        responses = await self._resolve(questions, overwrite=overwrite)
+        return [self.build_answer(q, r) for q, r in zip(questions, responses)]
 
-        total = len(list(question_set.get_questions()))
-        print(f"ask_multiple_stream: starting for {total} questions with {self.max_workers} workers")
-        started = 0
+    async def _resolve(self, questions: List[Question], overwrite:bool = False) -> List[QueryResponse]:
+        responses = await self._lookup(questions, overwrite=overwrite)
+        misses = [i for i, response in enumerate(responses) if response is None]
+        if misses:
+            fresh = await self._fetch([questions[i] for i in misses], overwrite=overwrite)
+            for i, response in zip(misses, fresh):
+                responses[i] = response
+        return cast(List[QueryResponse], responses)
+
+    async def _lookup(self, questions: List[Question], overwrite:bool = False) -> List[Optional[QueryResponse]]:
+        """Reusable stored responses for questions, None where a query is needed."""
+        if overwrite:
+            return [None] * len(questions)
+        return await self.storage.get_responses_bulk(questions, valid_only=True)
+
+    async def _fetch(self, questions: List[Question], overwrite:bool = False) -> List[QueryResponse]:
+        """Query questions, serving what we can from the response cache, and save every response to storage.
+
+        With overwrite the response cache is not read, but fresh responses
+        still replace what it holds.
+        """
+        prompts = [question.value for question in questions]
+        responses: List[Optional[QueryResponse]] = [None] * len(prompts)
+        keys: List[str] = []
+        if self.response_cache is not None:
+            keys = [response_cache_key(self.query_handler, p) for p in prompts]
+            if not overwrite:
+                for i, key in enumerate(keys):
+                    full_response = await self.response_cache.get(key)
+                    if full_response is None:
+                        continue
+                    # Cached content may have been written for an older
+                    # response model; content that no longer validates is
+                    # queried again.
+                    try:
+                        fields = self.query_handler.extract_fields(full_response)
+                    except Exception as e:
+                        logger.debug("Ignoring response cache entry for %r: %s", prompts[i], e)
+                        continue
+                    response = responses[i] = QueryResponse(full_response=full_response, error=None)
+                    response._fields_cache = fields
+
+        # Prompts already being queried (by another caller, or earlier in
+        # this list) are awaited rather than sent again. An owned prompt
+        # stays registered until its response is saved, so a caller that
+        # missed storage in the meantime still shares it.
+        loop = asyncio.get_running_loop()
+        owned: List[int] = []
+        waiting: Dict[int, asyncio.Future] = {}
+        for i, response in enumerate(responses):
+            if response is not None:
+                continue
+            future = self._inflight.get(prompts[i])
+            if future is None:
+                self._inflight[prompts[i]] = loop.create_future()
+                owned.append(i)
+            else:
+                waiting[i] = future
 
-        async def process_question(question):
-            async with semaphore:
-                question.response_model = question_set.response_model
-                nonlocal started
-                started += 1
+        try:
+            if owned:
                 try:
-                    print(f"Processing question {started}/{total}: {question.template} - {question.word_set}")
-                    ans = await self.ask(question)
-                    print(f"Finished question {started}/{total}")
-                    return ans
-                except Exception as e:
-                    print(f"Error processing question {question.template} with words {question.word_set}: {e}")
+                    fresh = await self.query_handler.query_batch([prompts[i] for i in owned])
+                    assert len(fresh) == len(owned)
+                except BaseException as e:
+                    for i in owned:
+                        future = self._inflight[prompts[i]]
+                        if isinstance(e, Exception):
+                            future.set_exception(e)
+                            future.exception()  # mark retrieved; waiters still see it
+                        else:
+                            future.cancel()
                     raise
+                for i, response in zip(owned, fresh):
+                    assert isinstance(response, QueryResponse)
+                    responses[i] = response
+                    self._inflight[prompts[i]].set_result(response)
+                    if self.response_cache is not None and not response.error and response.full_response is not None:
+                        await self.response_cache.put(keys[i], response.full_response)
+
+            # Responses this caller has are saved before it waits on anyone
+            # else's query, so a failure there cannot lose them.
+            await self._save([(questions[i], r) for i, r in enumerate(responses) if i not in waiting])
+        finally:
+            for i in owned:
+                self._inflight.pop(prompts[i])
+
+        # Questions whose response was shared from another caller's query
+        # are saved under their own word_set too.
+        for i, future in waiting.items():
+            responses[i] = await asyncio.shield(future)
+        await self._save([(questions[i], cast(QueryResponse, responses[i])) for i in waiting])
+
+        return cast(List[QueryResponse], responses)
+
+    async def _save(self, items: List[Tuple[Question, QueryResponse]]) -> None:
+        """Save question/response pairs, through the single-row path when there is one."""
+        if len(items) == 1:
+            await self.storage.save_response(*items[0])
+        elif items:
+            await self.storage.save_responses_bulk(items)
+
+
+    async def ask_multiple_stream(self, question_set: QuestionSet, overwrite:bool=False):
+        # Only combinations of the axes the template uses are queried; each
+        # answer is then repeated across the values of the ignored axes. A
+        # max_questions cap counts full combinations, so that case keeps
+        # enumerating them all and relies on prompt sharing below instead.
+        broadcast = not (question_set.max_questions is not None and question_set.max_questions > 0)
+        if broadcast:
+            total = question_set.get_distinct_count()
+            questions = question_set.get_distinct_questions()
+        else:
+            total = question_set.get_count()
+            questions = question_set.get_questions()
+        logger.info("ask_multiple_stream: starting for %d questions in batches of %d with %d workers", total, self.batch_size, self.max_workers)
+        started = 0
+
+        # Combos that render to the same prompt (e.g. an axis the template
+        # never uses) share one query: the first one is sent, and later ones
+        # wait on its response through this map of prompt -> future.
+        shared: Dict[str, asyncio.Future] = {}
+
+        async def process_batch(batch):
+            # Questions come from the set with its response_model already set.
+            assert batch[0].response_model is question_set.response_model
+            nonlocal started
+            started += len(batch)
+            pending = None
+            try:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Processing %d/%d: %s - %s", started, total, question_set.template, [q.word_set for q in batch])
+                responses = await self._lookup(batch, overwrite=overwrite)
+                misses = [q for q, r in zip(batch, responses) if r is None]
+                # Start querying the misses before handing over the stored
+                # answers, so the request is in flight while they are consumed.
+                if misses:
+                    pending = asyncio.create_task(self._fetch(misses, overwrite=overwrite))
+                hits = []
+                for question, response in zip(batch, responses):
+                    if response is not None:
+                        shared[question.value].set_result(response)
+                        hits.extend(await expand(question, response, known_ok=True))
+                if hits:
+                    await results.put(hits)
+                fresh = await pending if pending is not None else []
+            except Exception as e:
+                logger.error("Error processing batch for %s with words %s: %s", question_set.template, [q.word_set for q in batch], e)
+                if pending is not None:
+                    pending.cancel()
+                for question in batch:
+                    future = shared[question.value]
+                    if not future.done():
+                        future.set_exception(e)
+                raise
+            answers = []
+            for question, response in zip(misses, fresh):
+                shared[question.value].set_result(response)
+                answers.extend(await expand(question, response))
+            return answers
+
+        async def follow(question, future):
+            response = await future
+            return await expand(question, response, save=True)
 
-        tasks = [process_question(q) for q in question_set.get_questions()]
-        for coro in asyncio.as_completed(tasks):
-            answer = await coro
-            yield answer
+        # Stored hits come from a valid_only lookup, so they can skip
+        # build_answer's None/error checks.
+        build_answer = self.build_answer
+        build_answer_ok = self._build_answer_ok
+
+        # save=True also stores the response under question itself, in the
+        # same bulk write as its broadcast variants. For a stored hit
+        # (known_ok) only the variants missing from storage are written, so
+        # rerunning a fully stored set writes nothing.
+        async def expand(question, response, known_ok=False, save=False):
+            answer = build_answer_ok(question, response) if known_ok else build_answer(question, response)
+            answers = [answer]
+            saves = [(question, response)] if save else []
+            if broadcast:
+                variants = question_set.broadcast(question)
+                next(variants)
+                variants = list(variants)
+                for variant in variants:
+                    answers.append(Answer(
+                        variant.word_set, answer.question_template, answer.question_value,
+                        answer.full_response, answer.fields, answer.error,
+                    ))
+                if known_ok and variants:
+                    stored = await self.storage.get_responses_bulk(variants, valid_only=True)
+                    variants = [v for v, r in zip(variants, stored) if r is None]
+                saves.extend((variant, response) for variant in variants)
+            if saves:
+                await self.storage.save_responses_bulk(saves)
+            return answers
+
+        # Questions are pulled lazily from the question set by a producer
+        # and handed to a fixed pool of workers through a bounded queue, so
+        # at most a few batches of Question objects exist at once however
+        # large the set is. Workers put answers on an output queue, then a
+        # sentinel once they see the end of the work queue.
+        work: asyncio.Queue = asyncio.Queue(maxsize=self.max_workers)
+        results: asyncio.Queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+
+        async def run(coro):
+            try:
+                await results.put(await coro)
+            except Exception as e:
+                await results.put(e)
+
+        followers: List[asyncio.Task] = []
+
+        async def produce():
+            try:
+                batch = []
+                for question in questions:
+                    future = shared.get(question.value)
+                    if future is not None:
+                        followers.append(asyncio.create_task(run(follow(question, future))))
+                        continue
+                    shared[question.value] = loop.create_future()
+                    batch.append(question)
+                    if len(batch) == self.batch_size:
+                        await work.put(batch)
+                        batch = []
+                if batch:
+                    await work.put(batch)
+            except Exception as e:
+                # E.g. a template naming a key the word_sets lack; handed to
+                # the consumer like a worker's error so it is raised there.
+                await results.put(e)
+            finally:
+                for _ in range(self.max_workers):
+                    await work.put(None)
+                await asyncio.gather(*followers)
+                await results.put(None)
+
+        async def worker():
+            while (batch := await work.get()) is not None:
+                await run(process_batch(batch))
+            await results.put(None)
+
+        tasks = [asyncio.create_task(worker()) for _ in range(self.max_workers)]
+        tasks.append(asyncio.create_task(produce()))
+        try:
+            finished = 0
+            while finished < len(tasks):
+                item = await results.get()
+                if item is None:
+                    finished += 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    for answer in item:
+                        yield answer
+        finally:
+            for task in tasks + followers:
+                task.cancel()
+            await asyncio.gather(*tasks, *followers, return_exceptions=True)
+            for future in shared.values():
+                if future.done() and not future.cancelled():
+                    future.exception()
 
     async def ask_multiple(self, question_set: QuestionSet, overwrite:bool=False, return_results:bool=True) -> List[Answer]:
         """Convenience method to gather all answers into a list."""
         answers = []
-        print("ask_multiple: gathering answers")
+        logger.debug("ask_multiple: gathering answers")
         try:
             async for answer in self.ask_multiple_stream(question_set, overwrite=overwrite):
                 if return_results:
                     answers.append(answer)
         except Exception as e:
-            print(f"ask_multiple: encountered error during processing: {e}")
+            logger.error("ask_multiple: encountered error during processing: %s", e)
             raise
-        print(f"ask_multiple: completed, collected {len(answers)} answers")
+        logger.info("ask_multiple: completed, collected %d answers", len(answers))
         return answers
 
-    def build_answer(self, question: Question, response: QueryResponse) -> Answer:
+    def build_answer(self, question: Question, response: Optional[QueryResponse]) -> Answer:
         if response is None:
-            response = QueryResponse(error="No response")
-        if not response.error:
-            assert response.full_response is not None
-            fields = self.query_handler.extract_fields(response.full_response)
-        else:
-            fields = {}
-        answer = Answer.from_question(question, response.full_response, fields)
-        return answer
+            response = _NO_RESPONSE
+        if response.error:
+            return Answer.from_question_bare(question, response.full_response, response.error)
+        return self._build_answer_ok(question, response)
 
-    async def dump_answers(self, filter: Optional[Dict[str, Callable[[str], bool]]] = None) -> AsyncIterable[Answer]:
-        async for question in self.storage.get_stored_questions():
-            if filter is not None:
-                for key in filter.keys():
-                    if key not in question.word_set:
-                        continue
-                    fn = filter[key]
-                    if not fn(question.word_set[key]):
-                        continue
+    def _build_answer_ok(self, question: Question, response: QueryResponse) -> Answer:
+        """build_answer for a response already known to be present and error-free."""
+        full_response = response.full_response
+        assert full_response is not None
+        fields = response._fields_cache
+        if fields is None:
+            fields = response._fields_cache = self.query_handler.extract_fields(full_response)
+        return Answer.from_question_with_fields(question, full_response, fields)
 
-            response = await self.storage.get_response(question)
-            answer = self.build_answer(question, response)
-            yield answer
\ No newline at end of file
+    async def dump_answers(self, filter: Optional[Dict[str, Callable[[str], bool]]] = None, template: Optional[str] = None, lookahead: int = 64) -> AsyncIterable[Answer]:
+        """Yield stored answers, optionally limited to one template and filtered by word_set.
+
+        filter maps a word_set key to a predicate on that key's value; a
+        question is skipped when any predicate for a key it has returns
+        false. Each predicate is called at most once per distinct value
+        during a call and its verdict reused for every other question with
+        that value, so predicates must be pure: a counter, sampling or
+        time-based predicate sees each value only once.
+        """
+        # A template narrows the scan to that template's stored questions
+        # before any word_set filter runs.
+        filter_items = [(key, fn, {}) for key, fn in filter.items()] if filter else None
+
+        def passes(word_set: Dict[str, str]) -> bool:
+            for key, fn, verdicts in filter_items:
+                if key not in word_set:
+                    continue
+                value = word_set[key]
+                verdict = verdicts.get(value)
+                if verdict is None:
+                    verdict = verdicts[value] = bool(fn(value))
+                if not verdict:
+                    return False
+            return True
+
+        # Responses are looked up in windows of `lookahead` questions. The
+        # next window's bulk lookup runs while the previous window's answers
+        # are consumed, so at most two windows are held at once.
+        async def answers_for(questions: List[Question], lookup) -> List[Answer]:
+            responses = await lookup
+            return [self.build_answer(q, r) for q, r in zip(questions, responses)]
+
+        window: List[Question] = []
+        fetching: Optional[Tuple[List[Question], asyncio.Task]] = None
+        try:
+            async for question in self.storage.get_stored_questions(template=template):
+                if filter_items and not passes(question.word_set):
+                    continue
+
+                window.append(question)
+                if len(window) < lookahead:
+                    continue
+                previous = fetching
+                fetching = (window, asyncio.create_task(self.storage.get_responses_bulk(window)))
+                window = []
+                if previous is not None:
+                    for answer in await answers_for(*previous):
+                        yield answer
+
+            if fetching is not None:
+                previous, fetching = fetching, None
+                for answer in await answers_for(*previous):
+                    yield answer
+            if window:
+                for answer in await answers_for(window, self.storage.get_responses_bulk(window)):
+                    yield answer
+        finally:
+            # The consumer stopped early: drop the lookup it will never read.
+            if fetching is not None:
+                fetching[1].cancel()
+
+    async def dump_jsonl(self, path: str | Path, filter: Optional[Dict[str, Callable[[str], bool]]] = None, template: Optional[str] = None) -> int:
+        """Write stored answers to path as JSON Lines and return how many were written.
+
+        filter and template select answers as in dump_answers, including its
+        once-per-value evaluation of filter predicates.
+
+        Each line holds the same columns as Answer.flattened. Answers are
+        encoded and written as dump_answers yields them, so no DataFrame or
+        list of rows is built however many answers are stored.
+        """
+        written = 0
+        with open(path, "wb") as f:
+            async for answer in self.dump_answers(filter=filter, template=template):
+                f.write(_json.dumps_bytes(answer._flat_row()))
+                f.write(b"\n")
+                written += 1
+        return written
@@ -0,0 +1,92 @@
+"""Shared pytest configuration and fixtures."""
+
+import json
+import time
+from typing import Any, Dict, List
+
+import httpx
+import pytest
+
+from robora.sonar_query import API_URL
+
+
+@pytest.fixture(autouse=True, scope="session")
+def _no_real_network():
+    """Fail any request that reaches a real httpx transport.
+
+    A test that forgets to route its client through a mock transport gets an
+    immediate ConnectError instead of waiting on DNS and connect timeouts.
+    Mock transports (httpx.MockTransport) are unaffected.
+    """
+    async def _blocked_async(self, request):
+        raise httpx.ConnectError(f"network access is disabled in tests: {request.url}", request=request)
+
+    def _blocked(self, request):
+        raise httpx.ConnectError(f"network access is disabled in tests: {request.url}", request=request)
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(httpx.AsyncHTTPTransport, "handle_async_request", _blocked_async)
+        mp.setattr(httpx.HTTPTransport, "handle_request", _blocked)
+        yield
+
+
+class FakeSonarAPI:
+    """httpx.MockTransport handler that serves replies and records request bodies.
+
+    Replies set with reply() are served in order; the last one keeps being
+    served once the queue is down to it. Replies set with reply_by_prompt()
+    are chosen by a substring of the first message, so concurrent requests
+    get the right reply whatever order they arrive in.
+    """
+
+    def __init__(self):
+        self.replies: List[httpx.Response] = []
+        self.by_prompt: Dict[str, httpx.Response] = {}
+        self.requests: List[Dict[str, Any]] = []
+        # time.monotonic() at which each request arrived.
+        self.sent_at: List[float] = []
+
+    @staticmethod
+    def completion(content: str, **extra) -> httpx.Response:
+        """A successful chat-completion reply whose single choice carries content."""
+        return httpx.Response(200, json={"choices": [{"message": {"role": "assistant", "content": content}}], **extra})
+
+    @property
+    def transport(self) -> httpx.MockTransport:
+        """A transport that serves this fake, for SonarQueryHandler(transport=...)."""
+        return httpx.MockTransport(self)
+
+    def reply(self, *replies: httpx.Response) -> None:
+        self.replies = list(replies)
+
+    def reply_by_prompt(self, replies: Dict[str, httpx.Response]) -> None:
+        self.by_prompt = replies
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        assert request.url == API_URL
+        assert request.headers["Content-Type"] == "application/json"
+        body = json.loads(request.content)
+        self.requests.append(body)
+        self.sent_at.append(time.monotonic())
+        prompt = body["messages"][0]["content"]
+        for needle, reply in self.by_prompt.items():
+            if needle in prompt:
+                return reply
+        assert self.replies, f"no reply set for prompt: {prompt[:60]!r}"
+        return self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+
+
+@pytest.fixture(scope="module")
+def paris_reply() -> httpx.Response:
+    """The valid reply most tests expect; built once per module.
+
+    Safe to share: httpx reads the body once and serves the cached content
+    on every later send, and tests never modify it.
+    """
+    return FakeSonarAPI.completion('{"answer": "Paris"}')
+
+
+@pytest.fixture
+def sonar_api() -> FakeSonarAPI:
+    """A fresh FakeSonarAPI; hand its transport to the handler under test."""
+    return FakeSonarAPI()
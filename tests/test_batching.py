@@ -0,0 +1,57 @@
+"""Tests for the BatchingQueryHandler wrapper."""
+
+import asyncio
+from typing import List
+from robora.batching import BatchingQueryHandler
+from robora.classes import QueryHandler, QueryResponse
+
+
+class RecordingQueryHandler(QueryHandler):
+    """Answers each prompt with itself and records every batch it is sent."""
+
+    def __init__(self):
+        self.batches: List[List[str]] = []
+
+    async def query_batch(self, prompts: List[str]) -> List[QueryResponse]:
+        self.batches.append(list(prompts))
+        return [QueryResponse(full_response={"prompt": p}) for p in prompts]
+
+
+class FailingQueryHandler(QueryHandler):
+    """Raises on every batch."""
+
+    async def query_batch(self, prompts: List[str]) -> List[QueryResponse]:
+        raise RuntimeError("provider down")
+
+
+class TestBatchingQueryHandler:
+    """Test coalescing of concurrent prompts."""
+
+    def setup_method(self):
+        """Set up a batching handler over a recording handler."""
+        self.inner = RecordingQueryHandler()
+        self.handler = BatchingQueryHandler(self.inner, max_batch_size=3, max_latency_ms=10)
+
+    async def test_concurrent_queries_share_batches(self):
+        """Test that concurrent prompts are sent in batches of at most max_batch_size."""
+        prompts = [f"p{i}" for i in range(5)]
+
+        responses = await asyncio.gather(*(self.handler.query(p) for p in prompts))
+
+        assert [r.full_response["prompt"] for r in responses] == prompts
+        assert self.inner.batches == [["p0", "p1", "p2"], ["p3", "p4"]]
+
+    async def test_lone_query_is_sent_after_latency(self):
+        """Test that a partial batch is flushed once max_latency_ms passes."""
+        response = await asyncio.wait_for(self.handler.query("only"), timeout=1)
+
+        assert response.full_response == {"prompt": "only"}
+        assert self.inner.batches == [["only"]]
+
+    async def test_batch_failure_reaches_every_caller(self):
+        """Test that an error from the wrapped handler is raised for each prompt."""
+        handler = BatchingQueryHandler(FailingQueryHandler(), max_batch_size=2)
+
+        results = await asyncio.gather(handler.query("a"), handler.query("b"), return_exceptions=True)
+
+        assert all(isinstance(r, RuntimeError) for r in results)
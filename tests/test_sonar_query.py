@@ -0,0 +1,223 @@
+"""Tests for the Perplexity Sonar query handler against a fake in-process API."""
+
+import asyncio
+import subprocess
+import sys
+import httpx
+import pytest
+from pydantic import BaseModel, ValidationError
+from robora.sonar_query import MAX_RETRY_DELAY, SonarQueryHandler
+
+
+class CityModel(BaseModel):
+    """Minimal structured response model."""
+    answer: str
+
+
+class TestSonarQueryHandler:
+    """Test SonarQueryHandler request, retry and parsing behaviour."""
+
+    @pytest.fixture(autouse=True)
+    def setup_handler(self, sonar_api):
+        """Set up a handler that talks to the fake API and retries without sleeping."""
+        self.handler = SonarQueryHandler(CityModel, retry_delay=0, transport=sonar_api.transport)
+
+    async def test_query_returns_validated_response(self, sonar_api, paris_reply):
+        """Test that a valid structured reply is returned without retries."""
+        sonar_api.reply(paris_reply)
+
+        result = await self.handler.query("What is the capital of France?")
+
+        assert result.error is None
+        assert result.retries == 0
+        assert self.handler.extract_fields(result.full_response)["answer"] == "Paris"
+        assert len(sonar_api.requests) == 1
+        assert sonar_api.requests[0]["response_format"]["json_schema"]["schema"] == CityModel.model_json_schema()
+
+    async def test_query_retries_with_validation_feedback(self, sonar_api, paris_reply):
+        """Test that invalid content is retried with the error fed back to the model."""
+        sonar_api.reply(sonar_api.completion('{"wrong": 1}'), paris_reply)
+
+        result = await self.handler.query("What is the capital of France?")
+
+        assert result.error is None
+        assert result.retries == 1
+        messages = sonar_api.requests[-1]["messages"]
+        assert [m["role"] for m in messages] == ["user", "assistant", "user"]
+        assert "failed validation" in messages[2]["content"]
+
+    async def test_query_fills_fields_from_validated_content(self, sonar_api, paris_reply):
+        """Test that a queried response carries the fields of the content it validated."""
+        sonar_api.reply(paris_reply)
+
+        result = await self.handler.query("What is the capital of France?")
+
+        assert result._fields_cache == {"answer": "Paris", "enriched_citations": []}
+
+    def test_client_from_previous_event_loop_is_closed(self, sonar_api, paris_reply):
+        """Test that moving to a new event loop closes the client made on the old one."""
+        sonar_api.reply(paris_reply, paris_reply)
+        asyncio.run(self.handler.query("What is the capital of France?"))
+        first = self.handler._client
+
+        asyncio.run(self.handler.query("What is the capital of France?"))
+
+        assert first.is_closed
+        assert self.handler._client is not first
+
+    def test_extract_fields_validates_stored_content_by_default(self, sonar_api):
+        """Test that content not validated by this handler, e.g. read back from storage, is validated."""
+        stored = sonar_api.completion('{"wrong": 1}').json()
+
+        with pytest.raises(ValidationError):
+            self.handler.extract_fields(stored)
+        assert "answer" not in SonarQueryHandler(CityModel, trust_schema=True).extract_fields(stored)
+
+    @pytest.mark.parametrize("replies, succeeds, requests", [
+        ([503, '{"answer": "Paris"}'], True, 2),
+        ([429, '{"answer": "Paris"}'], True, 2),
+        ([401], False, 1),
+        (["not json"], False, SonarQueryHandler.max_retries + 1),
+    ], ids=["server-error-retried", "rate-limit-retried", "client-error-not-retried", "invalid-content-exhausts-retries"])
+    async def test_retry_policy(self, sonar_api, replies, succeeds, requests):
+        """Test which failures are retried and how many requests each takes.
+
+        Each reply is an HTTP status to fail with or content to complete with.
+        """
+        sonar_api.reply(*(
+            httpx.Response(r) if isinstance(r, int) else sonar_api.completion(r)
+            for r in replies
+        ))
+
+        result = await self.handler.query("What is the capital of France?")
+
+        assert (result.error is None) == succeeds
+        assert (result.full_response is not None) == succeeds
+        assert len(sonar_api.requests) == requests
+
+    @pytest.mark.parametrize("attempt, low, high", [
+        (1, 0.5, 1.0),
+        (2, 1.0, 2.0),
+        (4, 4.0, 8.0),
+        (20, MAX_RETRY_DELAY / 2, MAX_RETRY_DELAY),
+    ])
+    def test_retry_wait_backs_off_exponentially_with_jitter(self, attempt, low, high):
+        """Test that retry waits double per attempt, jitter within their upper half, and are capped."""
+        handler = SonarQueryHandler(CityModel, retry_delay=1.0)
+
+        waits = [handler._retry_wait(attempt) for _ in range(50)]
+
+        assert all(low <= wait <= high for wait in waits)
+        assert len(set(waits)) > 1
+
+    def test_retry_wait_honours_retry_after(self):
+        """Test that a longer Retry-After wins over the backoff, still under the cap."""
+        handler = SonarQueryHandler(CityModel, retry_delay=1.0)
+
+        assert handler._retry_wait(1, retry_after=5.0) == 5.0
+        assert handler._retry_wait(1, retry_after=MAX_RETRY_DELAY * 10) == MAX_RETRY_DELAY
+
+    async def test_concurrent_queries_get_their_own_replies(self, sonar_api, paris_reply):
+        """Test that concurrent queries over the pooled client are answered independently."""
+        sonar_api.reply_by_prompt({
+            "France": paris_reply,
+            "Italy": sonar_api.completion('{"answer": "Rome"}'),
+        })
+
+        france, italy = await asyncio.gather(
+            self.handler.query("What is the capital of France?"),
+            self.handler.query("What is the capital of Italy?"),
+        )
+
+        assert self.handler.extract_fields(france.full_response)["answer"] == "Paris"
+        assert self.handler.extract_fields(italy.full_response)["answer"] == "Rome"
+        assert len(sonar_api.requests) == 2
+
+    async def test_requests_per_minute_spaces_requests(self, sonar_api, paris_reply):
+        """Test that concurrent queries are sent one pacing interval apart."""
+        sonar_api.reply(paris_reply)
+        handler = SonarQueryHandler(CityModel, retry_delay=0, transport=sonar_api.transport, requests_per_minute=600)
+
+        await asyncio.gather(*(handler.query("What is the capital of France?") for _ in range(3)))
+
+        sent = sonar_api.sent_at
+        gaps = [later - earlier for earlier, later in zip(sent, sent[1:])]
+        assert len(sent) == 3
+        assert all(gap >= 0.09 for gap in gaps)
+
+    async def test_query_batch_splits_items(self, sonar_api):
+        """Test that a batched reply is split into one response per prompt."""
+        sonar_api.reply(sonar_api.completion('{"items": [{"answer": "Paris"}, {"answer": "Rome"}]}'))
+
+        results = await self.handler.query_batch(["France?", "Italy?"])
+
+        assert [self.handler.extract_fields(r.full_response)["answer"] for r in results] == ["Paris", "Rome"]
+        assert len(sonar_api.requests) == 1
+
+    async def test_query_batch_keeps_shared_citations_apart(self, sonar_api):
+        """Test that batch-level citations are kept aside rather than attributed to every item."""
+        sonar_api.reply(sonar_api.completion(
+            '{"items": [{"answer": "Paris"}, {"answer": "Rome"}]}',
+            citations=["https://a.example"],
+            search_results=[{"url": "https://a.example", "title": "A"}],
+        ))
+
+        results = await self.handler.query_batch(["France?", "Italy?"])
+
+        assert all(self.handler.extract_fields(r.full_response)["enriched_citations"] == [] for r in results)
+        assert all(r.full_response["batch_citations"] == ["https://a.example"] for r in results)
+
+    async def test_query_batch_falls_back_to_single_queries_on_item_mismatch(self, sonar_api, paris_reply):
+        """Test that a batch reply with the wrong number of items is retried prompt by prompt."""
+        sonar_api.reply(sonar_api.completion('{"items": [{"answer": "Paris"}]}'), paris_reply)
+
+        results = await self.handler.query_batch(["France?", "Also France?"])
+
+        assert [r.error for r in results] == [None, None]
+        assert [self.handler.extract_fields(r.full_response)["answer"] for r in results] == ["Paris", "Paris"]
+        assert len(sonar_api.requests) == 3
+
+    async def test_extract_fields_enriches_citations(self, sonar_api):
+        """Test that citations are matched against search results."""
+        sonar_api.reply(sonar_api.completion(
+            '{"answer": "Paris"}',
+            citations=["https://a.example", "https://b.example"],
+            search_results=[{"url": "https://a.example", "title": "A"}],
+        ))
+
+        result = await self.handler.query("What is the capital of France?")
+        citations = self.handler.extract_fields(result.full_response)["enriched_citations"]
+
+        assert [(c["url"], c["title"], c["matched"]) for c in citations] == [
+            ("https://a.example", "A", True),
+            ("https://b.example", None, False),
+        ]
+
+    async def test_extract_fields_shares_repeated_citations(self, sonar_api):
+        """Test that a URL cited twice keeps both positions as separate, equal entries."""
+        sonar_api.reply(sonar_api.completion(
+            '{"answer": "Paris"}',
+            citations=["https://a.example", "https://b.example", "https://a.example"],
+            search_results=[{"url": "https://a.example", "title": "A"}],
+        ))
+
+        result = await self.handler.query("What is the capital of France?")
+        citations = self.handler.extract_fields(result.full_response)["enriched_citations"]
+
+        assert [c["url"] for c in citations] == ["https://a.example", "https://b.example", "https://a.example"]
+        assert citations[0] == citations[2]
+        assert citations[2]["title"] == "A"
+        citations[0]["title"] = "changed"
+        assert citations[2]["title"] == "A"
+
+
+def test_package_import_defers_heavy_modules():
+    """Test that importing robora loads neither the Sonar handler, pandas nor numpy until they are used."""
+    code = (
+        "import sys, robora\n"
+        "assert 'robora.sonar_query' not in sys.modules\n"
+        "assert 'pandas' not in sys.modules\n"
+        "assert 'numpy' not in sys.modules\n"
+        "assert robora.SonarQueryHandler.__module__ == 'robora.sonar_query'\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -1,9 +1,13 @@
 """Tests for SQLite storage provider implementation."""
 
-import pytest
 import asyncio
 import tempfile
 import os
+import json
+import sqlite3
+import subprocess
+import sys
+import pytest
 from pathlib import Path
 from robora.sqlite_storage import SQLiteStorageProvider
 from robora.classes import Question, QueryResponse
@@ -14,93 +18,57 @@ class MockResponseModel:
     __name__ = "MockResponseModel"
 
 
+def make_question(org: str, template: str = "Question about {org}", **words: str) -> Question:
+    """Build a test Question for org, plus any other template words."""
+    return Question(word_set={"org": org, **words}, template=template, response_model=MockResponseModel)
+
+
 class TestSQLiteStorageProvider:
     """Test the SQLiteStorageProvider implementation."""
     
+    @classmethod
+    def setup_class(cls):
+        """Create one temporary database and provider shared by the class."""
+        temp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        temp_db.close()
+        cls.db_path = temp_db.name
+        cls.storage = SQLiteStorageProvider(db_path=cls.db_path)
+
+    @classmethod
+    def teardown_class(cls):
+        """Close the shared provider and remove the temporary database file."""
+        cls.storage.close()
+        if os.path.exists(cls.db_path):
+            os.unlink(cls.db_path)
+
     def setup_method(self):
-        """Set up test fixtures with temporary database."""
-        # Create a temporary database file for each test
-        self.temp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
-        self.temp_db.close()
-        self.db_path = self.temp_db.name
-        
-        self.storage = SQLiteStorageProvider(db_path=self.db_path)
-        self.question = Question(
-            word_set={"org": "TestOrg"},
-            template="Test question about {org}",
-            response_model=MockResponseModel
-        )
-    
-    def teardown_method(self):
-        """Clean up test fixtures."""
-        # Remove the temporary database file
-        if os.path.exists(self.db_path):
-            os.unlink(self.db_path)
+        """Empty the shared database so each test starts from no rows."""
+        self.storage.clear()
+        self.question = make_question("TestOrg", "Test question about {org}")
     
-    @pytest.mark.asyncio
-    async def test_save_and_retrieve_response(self):
-        """Test saving and retrieving responses."""
-        test_response = QueryResponse(
-            full_response={"test": "data", "cybersecurity_level": 7},
-            error=None
-        )
-        
-        # Save response
-        await self.storage.save_response(self.question, test_response)
+    @pytest.mark.parametrize("full_response, error", [
+        ({"test": "data", "cybersecurity_level": 7}, None),
+        (None, "Test error message"),
+    ], ids=["with-data", "with-error"])
+    async def test_save_and_retrieve_response(self, full_response, error):
+        """Test that a saved response, successful or failed, is retrieved unchanged."""
+        await self.storage.save_response(self.question, QueryResponse(full_response=full_response, error=error))
         assert self.storage.count() == 1
-        
-        # Retrieve response
-        retrieved = await self.storage.get_response(self.question)
-        assert retrieved is not None
-        assert retrieved.full_response == test_response.full_response
-        assert retrieved.error == test_response.error
-    
-    @pytest.mark.asyncio
-    async def test_retrieve_nonexistent_response(self):
-        """Test retrieving a response that doesn't exist."""
-        nonexistent_question = Question(
-            word_set={"org": "NonExistent"},
-            template="Question about {org}",
-            response_model=MockResponseModel
-        )
-        
-        retrieved = await self.storage.get_response(nonexistent_question)
-        assert retrieved is None
-    
-    @pytest.mark.asyncio
-    async def test_save_response_with_error(self):
-        """Test saving and retrieving a response with an error."""
-        error_response = QueryResponse(
-            full_response=None,
-            error="Test error message"
-        )
-        
-        await self.storage.save_response(self.question, error_response)
+
         retrieved = await self.storage.get_response(self.question)
-        
         assert retrieved is not None
-        assert retrieved.full_response is None
-        assert retrieved.error == "Test error message"
+        assert retrieved.full_response == full_response
+        assert retrieved.error == error
     
-    @pytest.mark.asyncio
     async def test_multiple_responses(self):
         """Test storing multiple responses."""
-        question1 = Question(
-            word_set={"org": "Org1"},
-            template="Question about {org}",
-            response_model=MockResponseModel
-        )
-        question2 = Question(
-            word_set={"org": "Org2"},
-            template="Question about {org}",
-            response_model=MockResponseModel
-        )
+        question1 = make_question("Org1")
+        question2 = make_question("Org2")
         
         response1 = QueryResponse(full_response={"data": "response1"}, error=None)
         response2 = QueryResponse(full_response={"data": "response2"}, error=None)
         
-        await self.storage.save_response(question1, response1)
-        await self.storage.save_response(question2, response2)
+        await self.storage.save_responses_bulk([(question1, response1), (question2, response2)])
         
         assert self.storage.count() == 2
         
@@ -110,7 +78,6 @@ class TestSQLiteStorageProvider:
         assert resp1.full_response["data"] == "response1"
         assert resp2.full_response["data"] == "response2"
     
-    @pytest.mark.asyncio
     async def test_update_existing_response(self):
         """Test updating an existing response (INSERT OR REPLACE)."""
         original_response = QueryResponse(
@@ -134,7 +101,6 @@ class TestSQLiteStorageProvider:
         retrieved = await self.storage.get_response(self.question)
         assert retrieved.full_response["version"] == "updated"
     
-    @pytest.mark.asyncio
     async def test_delete_response(self):
         """Test deleting responses."""
         test_response = QueryResponse(full_response={"test": "data"}, error=None)
@@ -151,56 +117,14 @@ class TestSQLiteStorageProvider:
         retrieved = await self.storage.get_response(self.question)
         assert retrieved is None
     
-    @pytest.mark.asyncio
     async def test_delete_nonexistent_response(self):
         """Test deleting a response that doesn't exist (should not error)."""
-        nonexistent_question = Question(
-            word_set={"org": "NonExistent"},
-            template="Question about {org}",
-            response_model=MockResponseModel
-        )
+        nonexistent_question = make_question("NonExistent")
         
         # Should not raise an error
         await self.storage.delete_response(nonexistent_question)
         assert self.storage.count() == 0
     
-    @pytest.mark.asyncio
-    async def test_get_stored_questions(self):
-        """Test retrieving all stored questions."""
-        question1 = Question(
-            word_set={"org": "Org1"},
-            template="Question about {org}",
-            response_model=MockResponseModel
-        )
-        question2 = Question(
-            word_set={"org": "Org2", "country": "Country2"},
-            template="Question about {org} in {country}",
-            response_model=MockResponseModel
-        )
-        
-        response1 = QueryResponse(full_response={"data": "response1"}, error=None)
-        response2 = QueryResponse(full_response={"data": "response2"}, error=None)
-        
-        await self.storage.save_response(question1, response1)
-        await self.storage.save_response(question2, response2)
-        
-        # Collect all stored questions
-        stored_questions = []
-        async for question in self.storage.get_stored_questions():
-            stored_questions.append(question)
-        
-        assert len(stored_questions) == 2
-        
-        # Verify questions are properly deserialized
-        # Note: Questions won't be exactly equal due to response_model being None after deserialization
-        question_templates = [q.template for q in stored_questions]
-        question_word_sets = [q.word_set for q in stored_questions]
-        
-        assert "Question about {org}" in question_templates
-        assert "Question about {org} in {country}" in question_templates
-        assert {"org": "Org1"} in question_word_sets
-        assert {"org": "Org2", "country": "Country2"} in question_word_sets
-    
     def test_utility_methods(self):
         """Test utility methods."""
         assert self.storage.count() == 0
@@ -243,9 +167,40 @@ class TestSQLiteStorageProvider:
         
         # Verify we can retrieve the data
         retrieved = asyncio.run(new_storage.get_response(self.question))
+        new_storage.close()
         assert retrieved is not None
         assert retrieved.full_response["persistent"] == "data"
     
+    async def test_count_sees_rows_written_by_another_connection(self):
+        """Test that count reflects rows another provider wrote to the same file."""
+        assert self.storage.count() == 0
+        other = SQLiteStorageProvider(db_path=self.db_path)
+        try:
+            await other.save_response(self.question, QueryResponse(full_response={"n": 1}))
+        finally:
+            other.close()
+
+        assert self.storage.count() == 1
+
+    async def test_fingerprint_collision_is_a_miss(self):
+        """Test that a row stored under a colliding fingerprint is not returned."""
+        other = Question(
+            word_set={"org": "OtherOrg", "country": "OtherCountry"},
+            template="Test {org} in {country}",
+            response_model=MockResponseModel
+        )
+        await self.storage.save_response(other, QueryResponse(full_response={"other": True}))
+        # Rekey the other question's row as if its fingerprint collided.
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute(
+                "UPDATE question_responses SET question_hash = ? WHERE question_hash = ?",
+                (self.question.fingerprint, other.fingerprint)
+            )
+
+        assert await self.storage.get_response(self.question) is None
+        assert await self.storage.get_response_valid(self.question) is False
+        assert await self.storage.get_responses_bulk([self.question]) == [None]
+
     def test_question_hashing_consistency(self):
         """Test that question hashing works consistently for storage/retrieval."""
         # Create two identical questions
@@ -269,4 +224,179 @@ class TestSQLiteStorageProvider:
         
         retrieved = asyncio.run(self.storage.get_response(question2))
         assert retrieved is not None
-        assert retrieved.full_response["test"] == "hash_consistency"
\ No newline at end of file
+        assert retrieved.full_response["test"] == "hash_consistency"
+
+    async def test_save_responses_bulk(self):
+        """Test that bulk saves store every pair and replace existing entries."""
+        questions = [
+            make_question(f"Org{i}") for i in range(3)
+        ]
+        await self.storage.save_response(questions[0], QueryResponse(full_response=None, error="old"))
+
+        await self.storage.save_responses_bulk([(q, QueryResponse(full_response={"n": i})) for i, q in enumerate(questions)])
+
+        assert self.storage.count() == 3
+        retrieved = await self.storage.get_responses_bulk(questions, valid_only=True)
+        assert [r.full_response for r in retrieved] == [{"n": 0}, {"n": 1}, {"n": 2}]
+
+    def test_database_uses_wal_journal(self):
+        """Test that the provider switches the database file to WAL journaling."""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        finally:
+            conn.close()
+
+    async def test_save_responses_bulk_serializes_shared_response_once(self, monkeypatch):
+        """Test that one response saved under many questions is serialized once."""
+        calls = []
+        serialize = self.storage._serialize_response
+        monkeypatch.setattr(self.storage, "_serialize_response", lambda r: calls.append(r) or serialize(r))
+        response = QueryResponse(full_response={"shared": True})
+
+        await self.storage.save_responses_bulk([(make_question(f"Org{i}"), response) for i in range(3)])
+
+        assert len(calls) == 1
+        retrieved = await self.storage.get_responses_bulk([make_question(f"Org{i}") for i in range(3)])
+        assert [r.full_response for r in retrieved] == [{"shared": True}] * 3
+
+    async def test_concurrent_saves_share_one_transaction(self, monkeypatch):
+        """Test that saves made together are written in one transaction and all land."""
+        writes = []
+        write_rows = self.storage._write_rows
+        monkeypatch.setattr(self.storage, "_write_rows", lambda rows: writes.append(len(rows)) or write_rows(rows))
+        questions = [make_question(f"Org{i}") for i in range(5)]
+
+        await asyncio.gather(*(self.storage.save_response(q, QueryResponse(full_response={"n": i})) for i, q in enumerate(questions)))
+
+        assert writes == [5]
+        assert self.storage.count() == 5
+        retrieved = await self.storage.get_responses_bulk(questions)
+        assert [r.full_response for r in retrieved] == [{"n": i} for i in range(5)]
+
+    async def test_bulk_save_is_not_overwritten_by_earlier_queued_save(self):
+        """Test that a bulk save lands after a save_response queued before it."""
+        question = make_question("Org")
+
+        await asyncio.gather(
+            self.storage.save_response(question, QueryResponse(full_response={"n": "old"})),
+            self.storage.save_responses_bulk([(question, QueryResponse(full_response={"n": "new"}))]),
+        )
+
+        retrieved = await self.storage.get_response(question)
+        assert retrieved.full_response == {"n": "new"}
+
+    async def test_persistence_across_processes(self):
+        """Test that a response saved by another process (different hash seed) is found."""
+        script = (
+            "import asyncio\n"
+            "from robora.sqlite_storage import SQLiteStorageProvider\n"
+            "from robora.classes import Question, QueryResponse\n"
+            f"storage = SQLiteStorageProvider(db_path={self.db_path!r})\n"
+            "question = Question({'org': 'TestOrg'}, 'Test question about {org}', None)\n"
+            "asyncio.run(storage.save_response(question, QueryResponse(full_response={'from': 'child'})))\n"
+        )
+        env = dict(os.environ, PYTHONHASHSEED="12345", PYTHONPATH=str(Path(__file__).resolve().parent.parent))
+        subprocess.run([sys.executable, "-c", script], check=True, env=env)
+
+        storage = SQLiteStorageProvider(db_path=self.db_path)
+        retrieved = await storage.get_response(self.question)
+        storage.close()
+        assert retrieved is not None
+        assert retrieved.full_response == {"from": "child"}
+
+    async def test_rekeys_database_from_older_versions(self, tmp_path):
+        """Test that rows keyed by the old per-process hash are found after reopening."""
+        db_path = tmp_path / "old.db"
+        with sqlite3.connect(db_path) as conn:
+            conn.execute("""
+                CREATE TABLE question_responses (
+                    question_hash INTEGER PRIMARY KEY,
+                    question_json TEXT NOT NULL,
+                    response_json TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.execute(
+                "INSERT INTO question_responses (question_hash, question_json, response_json) VALUES (?, ?, ?)",
+                (42, json.dumps({"word_set": self.question.word_set, "template": self.question.template}),
+                 json.dumps({"full_response": {"old": True}, "error": None}))
+            )
+
+        storage = SQLiteStorageProvider(db_path=db_path)
+        retrieved = await storage.get_response(self.question)
+        storage.close()
+        assert retrieved is not None
+        assert retrieved.full_response == {"old": True}
+
+
+class TestSQLiteStorageQueries:
+    """Read-only lookups against one SQLite database populated once for the class."""
+
+    ORG1 = make_question("Org1")
+    ORG2_IN_COUNTRY = make_question("Org2", "Question about {org} in {country}", country="Country2")
+    FAILED = make_question("Failed")
+    OTHER_TEMPLATE = make_question("TestOrg", "Other question about {org}")
+    MISSING = make_question("NonExistent")
+
+    @classmethod
+    def setup_class(cls):
+        """Create and populate the shared database; tests must not write to it."""
+        temp_db = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        temp_db.close()
+        cls.db_path = temp_db.name
+        cls.storage = SQLiteStorageProvider(db_path=cls.db_path)
+        asyncio.run(cls.storage.save_responses_bulk([
+            (cls.ORG1, QueryResponse(full_response={"data": "response1"})),
+            (cls.ORG2_IN_COUNTRY, QueryResponse(full_response={"data": "response2"})),
+            (cls.FAILED, QueryResponse(full_response=None, error="boom")),
+            (cls.OTHER_TEMPLATE, QueryResponse(full_response={})),
+        ]))
+
+    @classmethod
+    def teardown_class(cls):
+        """Close the shared provider and remove the temporary database file."""
+        cls.storage.close()
+        if os.path.exists(cls.db_path):
+            os.unlink(cls.db_path)
+
+    async def test_retrieve_nonexistent_response(self):
+        """Test retrieving a response that doesn't exist."""
+        assert await self.storage.get_response(self.MISSING) is None
+
+    async def test_get_stored_questions(self):
+        """Test retrieving all stored questions."""
+        stored_questions = [q async for q in self.storage.get_stored_questions()]
+
+        # Questions won't be exactly equal due to response_model being None after deserialization
+        assert sorted((q.template, sorted(q.word_set.items())) for q in stored_questions) == sorted(
+            (q.template, sorted(q.word_set.items()))
+            for q in [self.ORG1, self.ORG2_IN_COUNTRY, self.FAILED, self.OTHER_TEMPLATE]
+        )
+
+    async def test_get_stored_questions_for_template(self):
+        """Test filtering stored questions by template."""
+        questions = [q async for q in self.storage.get_stored_questions(template=self.OTHER_TEMPLATE.template)]
+
+        assert [q.word_set for q in questions] == [self.OTHER_TEMPLATE.word_set]
+
+    async def test_get_responses_bulk(self):
+        """Test bulk retrieval returns responses in question order, None for misses."""
+        retrieved = await self.storage.get_responses_bulk([self.ORG1, self.MISSING, self.FAILED])
+
+        assert retrieved[0].full_response == {"data": "response1"}
+        assert retrieved[1] is None
+        assert retrieved[2].error == "boom"
+
+    async def test_get_responses_bulk_valid_only(self):
+        """Test that valid_only bulk retrieval treats error responses as misses."""
+        retrieved = await self.storage.get_responses_bulk([self.FAILED, self.ORG2_IN_COUNTRY], valid_only=True)
+
+        assert retrieved[0] is None
+        assert retrieved[1].full_response == {"data": "response2"}
+
+    async def test_get_response_valid(self):
+        """Test that only error-free stored responses count as valid."""
+        assert await self.storage.get_response_valid(self.ORG1)
+        assert not await self.storage.get_response_valid(self.FAILED)
+        assert not await self.storage.get_response_valid(self.MISSING)
@@ -0,0 +1,401 @@
+"""Tests for the Workflow orchestration layer."""
+
+import asyncio
+import json
+import logging
+from typing import List
+import pytest
+from robora.cache import response_cache_key
+from robora.classes import Answer, Question, QuestionSet, QueryResponse
+from robora.mock_query import MockQueryHandler, MockResponseModel
+from robora.session_storage import SessionStorageProvider
+from robora.sqlite_storage import SQLiteStorageProvider
+from robora.workflow import Workflow
+
+
+class CountingQueryHandler(MockQueryHandler):
+    """MockQueryHandler that records every prompt and batch it is sent, and counts field extractions."""
+
+    def __init__(self):
+        super().__init__(MockResponseModel)
+        self.prompts: List[str] = []
+        self.batches: List[List[str]] = []
+        self.extractions = 0
+
+    async def query(self, prompt: str) -> QueryResponse:
+        self.prompts.append(prompt)
+        return await super().query(prompt)
+
+    async def query_batch(self, prompts: List[str]) -> List[QueryResponse]:
+        self.batches.append(list(prompts))
+        return await super().query_batch(prompts)
+
+    def extract_fields(self, full_response):
+        self.extractions += 1
+        return super().extract_fields(full_response)
+
+
+class GatedQueryHandler(CountingQueryHandler):
+    """CountingQueryHandler whose queries for prompts containing "fail" wait for gate, then raise."""
+
+    def __init__(self):
+        super().__init__()
+        self.gate = asyncio.Event()
+
+    async def query(self, prompt: str) -> QueryResponse:
+        if "fail" in prompt:
+            self.prompts.append(prompt)
+            await self.gate.wait()
+            raise RuntimeError("query failed")
+        return await super().query(prompt)
+
+
+@pytest.fixture(scope="module")
+def question_set() -> QuestionSet:
+    """The 2 x 3 question set most tests ask; QuestionSet is immutable, so one is shared."""
+    return QuestionSet(
+        template="Question about {org} in {country}",
+        word_sets={"org": ["Org1", "Org2"], "country": ["A", "B", "C"]},
+        response_model=MockResponseModel
+    )
+
+
+class TestWorkflow:
+    """Test Workflow against the in-memory and SQLite storage providers."""
+
+    @pytest.fixture(autouse=True, params=["session", "sqlite"])
+    def setup_workflow(self, request, tmp_path, question_set):
+        """Set up a workflow with a counting handler over each empty storage provider."""
+        self.handler = CountingQueryHandler()
+        if request.param == "sqlite":
+            self.storage = SQLiteStorageProvider(db_path=tmp_path / "robora.db")
+        else:
+            self.storage = SessionStorageProvider()
+        self.workflow = Workflow(query_handler=self.handler, storage=self.storage)
+        self.question_set = question_set
+        yield
+        if request.param == "sqlite":
+            self.storage.close()
+
+    @pytest.mark.parametrize("kwargs, message", [
+        ({"workers": 0}, "workers"),
+        ({"batch_size": 0}, "batch_size"),
+    ], ids=["no-workers", "empty-batch"])
+    def test_rejects_invalid_settings(self, kwargs, message):
+        """Test that settings ask_multiple cannot run with are rejected when the Workflow is built."""
+        with pytest.raises(ValueError, match=message):
+            Workflow(query_handler=self.handler, storage=self.storage, **kwargs)
+
+    async def test_response_cache_serves_repeat_prompts(self, tmp_path):
+        """Test that a prompt answered once is served from the on-disk cache by a fresh workflow."""
+        question = Question({"org": "Org1", "country": "A"}, "Question about {org} in {country}", MockResponseModel)
+        first = await Workflow(query_handler=self.handler, storage=SessionStorageProvider(), cache_dir=tmp_path).ask(question)
+
+        workflow = Workflow(query_handler=self.handler, storage=SessionStorageProvider(), cache_dir=tmp_path)
+        second = await workflow.ask(question)
+
+        assert len(self.handler.prompts) == 1
+        assert second.full_response == first.full_response
+        assert workflow.response_cache.hits == 1
+        # One extraction per answer: the hit is validated once and its
+        # answer reuses those fields.
+        assert self.handler.extractions == 2
+
+    async def test_response_cache_entry_failing_validation_is_queried_again(self, tmp_path, monkeypatch):
+        """Test that a cached response the handler no longer accepts is treated as a miss."""
+        question = Question({"org": "Org1", "country": "A"}, "Question about {org} in {country}", MockResponseModel)
+        workflow = Workflow(query_handler=self.handler, storage=SessionStorageProvider(), cache_dir=tmp_path)
+        stale = {"choices": [{"message": {"content": "stale"}}]}
+        await workflow.response_cache.put(response_cache_key(self.handler, question.value), stale)
+        extract_fields = self.handler.extract_fields
+
+        def strict_extract_fields(full_response):
+            if full_response == stale:
+                raise ValueError("content no longer matches the response model")
+            return extract_fields(full_response)
+
+        monkeypatch.setattr(self.handler, "extract_fields", strict_extract_fields)
+        answer = await workflow.ask(question)
+
+        assert len(self.handler.prompts) == 1
+        assert answer.full_response != stale
+
+    async def test_overwrite_bypasses_response_cache(self, tmp_path):
+        """Test that overwrite queries again instead of reading the on-disk cache."""
+        question = Question({"org": "Org1", "country": "A"}, "Question about {org} in {country}", MockResponseModel)
+        workflow = Workflow(query_handler=self.handler, storage=self.storage, cache_dir=tmp_path)
+
+        await workflow.ask(question)
+        await workflow.ask(question, overwrite=True)
+
+        assert len(self.handler.prompts) == 2
+        assert workflow.response_cache.hits == 0
+
+    async def test_ask_uses_stored_response(self):
+        """Test that a second ask for an equal question is served from storage."""
+        question = Question({"org": "Org1", "country": "A"}, "Question about {org} in {country}", MockResponseModel)
+        same_question = Question({"org": "Org1", "country": "A"}, "Question about {org} in {country}", MockResponseModel)
+
+        first = await self.workflow.ask(question)
+        second = await self.workflow.ask(same_question)
+
+        assert len(self.handler.prompts) == 1
+        assert first.full_response == second.full_response
+        assert self.storage.count() == 1
+
+    async def test_ask_multiple_answers_every_combination(self):
+        """Test that every word_set combination gets an answer and is stored."""
+        answers = await self.workflow.ask_multiple(self.question_set)
+
+        assert len(answers) == 6
+        assert {(a.word_set["org"], a.word_set["country"]) for a in answers} == {
+            (org, country) for org in ["Org1", "Org2"] for country in ["A", "B", "C"]
+        }
+        assert len(self.handler.prompts) == 6
+        assert self.storage.count() == 6
+
+    async def test_ask_multiple_batches_prompts(self):
+        """Test that batch_size groups uncached prompts into query_batch calls."""
+        workflow = Workflow(query_handler=self.handler, storage=self.storage, batch_size=4)
+
+        answers = await workflow.ask_multiple(self.question_set)
+
+        assert len(answers) == 6
+        assert sorted(len(b) for b in self.handler.batches) == [2, 4]
+
+    async def test_ask_multiple_deduplicates_identical_prompts(self, caplog):
+        """Test that combos rendering the same prompt share a single query."""
+        # Axes the template ignores are a supported broadcast, noted at debug level only.
+        with caplog.at_level(logging.DEBUG, logger="robora.classes"):
+            question_set = QuestionSet(
+                template="Question about {org}",
+                word_sets={"org": ["Org1", "Org2"], "country": ["A", "B", "C"]},
+                response_model=MockResponseModel
+            )
+        assert [(r.levelno, "country" in r.getMessage()) for r in caplog.records] == [(logging.DEBUG, True)]
+
+        answers = await self.workflow.ask_multiple(question_set)
+
+        assert len(answers) == 6
+        assert {(a.word_set["org"], a.word_set["country"]) for a in answers} == {
+            (org, country) for org in ["Org1", "Org2"] for country in ["A", "B", "C"]
+        }
+        assert sorted(self.handler.prompts) == ["Question about Org1", "Question about Org2"]
+        assert self.storage.count() == 6
+
+    async def test_ask_multiple_rerun_writes_nothing_when_stored(self):
+        """Test that rerunning a fully stored broadcast set does not rewrite its rows."""
+        question_set = QuestionSet(
+            template="Question about {org}",
+            word_sets={"org": ["Org1", "Org2"], "country": ["A", "B", "C"]},
+            response_model=MockResponseModel
+        )
+        written = []
+        save, save_bulk = self.storage.save_response, self.storage.save_responses_bulk
+
+        async def counting_save(question, response):
+            written.append((question, response))
+            await save(question, response)
+
+        async def counting_save_bulk(items):
+            written.extend(items)
+            await save_bulk(items)
+
+        self.storage.save_response = counting_save
+        self.storage.save_responses_bulk = counting_save_bulk
+        await self.workflow.ask_multiple(question_set)
+        first_run = len(written)
+
+        answers = await self.workflow.ask_multiple(question_set)
+
+        assert first_run == 6
+        assert len(written) == first_run
+        assert len(answers) == 6
+
+    async def test_ask_multiple_respects_max_questions(self):
+        """Test that max_questions caps full combinations, not distinct prompts."""
+        question_set = QuestionSet(
+            template="Question about {org} in {country}",
+            word_sets={"org": ["Org1", "Org2"], "country": ["A", "B", "C"]},
+            response_model=MockResponseModel,
+            max_questions=4
+        )
+
+        answers = await self.workflow.ask_multiple(question_set)
+
+        assert len(answers) == 4
+        assert len(self.handler.prompts) == 4
+
+    async def test_ask_multiple_raises_for_bad_template(self):
+        """Test that an error building questions reaches the caller instead of ending the stream."""
+        question_set = QuestionSet(
+            template="Question about {org} in {missing}",
+            word_sets={"org": ["Org1", "Org2"]},
+            response_model=MockResponseModel
+        )
+
+        with pytest.raises(KeyError, match="missing"):
+            await self.workflow.ask_multiple(question_set)
+
+    def test_build_answer_carries_response_error(self):
+        """Test that a failed response yields an Answer with its error and no fields."""
+        question = Question({"org": "Org1", "country": "A"}, "Question about {org} in {country}", MockResponseModel)
+
+        answer = self.workflow.build_answer(question, QueryResponse(error="boom"))
+
+        assert answer.error == "boom"
+        assert dict(answer.fields) == {}
+        assert answer.flattened.loc[0, "error"] == "boom"
+
+    async def test_flatten_many_aligns_columns(self):
+        """Test that flattening answers with different columns matches row-wise DataFrame construction."""
+        import pandas as pd
+
+        answers = await self.workflow.ask_multiple(self.question_set)
+        failed = Question({"org": "Org3", "country": "D"}, "Question about {org} in {country}", MockResponseModel)
+        answers.insert(2, self.workflow.build_answer(failed, QueryResponse(error="boom")))
+
+        frame = Answer.flatten_many(answers)
+
+        pd.testing.assert_frame_equal(frame, pd.DataFrame([a._flat_row() for a in answers]))
+        assert frame.loc[2, "error"] == "boom"
+        assert pd.isna(frame.loc[2, "org"])
+
+    async def test_ask_multiple_mixes_stored_and_fresh(self):
+        """Test that a batch with stored and missing answers only queries the misses."""
+        workflow = Workflow(query_handler=self.handler, storage=self.storage, batch_size=6)
+        stored = Question({"org": "Org1", "country": "A"}, "Question about {org} in {country}", MockResponseModel)
+        await workflow.ask(stored)
+
+        answers = await workflow.ask_multiple(self.question_set)
+
+        assert len(answers) == 6
+        assert self.handler.batches[-1] == [q.value for q in self.question_set.get_questions() if q.value != stored.value]
+
+    async def test_dump_answers_for_one_template(self):
+        """Test that dump_answers can be limited to a single template's answers."""
+        await self.workflow.ask_multiple(self.question_set)
+        await self.workflow.ask(Question({"org": "Org1"}, "Other question about {org}", MockResponseModel))
+
+        answers = [a async for a in self.workflow.dump_answers(template="Other question about {org}")]
+
+        assert [a.question_value for a in answers] == ["Other question about Org1"]
+
+    async def test_concurrent_asks_share_one_query(self):
+        """Test that concurrent asks for the same prompt send a single query."""
+        questions = [
+            Question({"org": "Org1", "country": "A"}, "Question about {org} in {country}", MockResponseModel)
+            for _ in range(3)
+        ]
+
+        answers = await asyncio.gather(*(self.workflow.ask(q) for q in questions))
+
+        assert len(self.handler.prompts) == 1
+        assert all(a.full_response == answers[0].full_response for a in answers)
+        assert self.workflow._inflight == {}
+
+    @pytest.mark.parametrize("batched", [False, True], ids=["gathered-asks", "ask-batch"])
+    async def test_shared_prompt_is_stored_for_every_word_set(self, batched):
+        """Test that questions sharing one prompt are each stored, so none is queried again."""
+        questions = [
+            Question({"org": "Org1", "country": country}, "Question about {org}", MockResponseModel)
+            for country in ["A", "B"]
+        ]
+
+        if batched:
+            await self.workflow.ask_batch(questions)
+        else:
+            await asyncio.gather(*(self.workflow.ask(q) for q in questions))
+        await self.workflow.ask(questions[1])
+
+        assert self.handler.prompts == ["Question about Org1"]
+        assert self.storage.count() == 2
+
+    async def test_own_responses_are_saved_when_a_shared_query_fails(self):
+        """Test that a caller saves what it queried itself even if a query it waited on fails."""
+        handler = GatedQueryHandler()
+        workflow = Workflow(query_handler=handler, storage=self.storage)
+        ok = Question({"org": "ok"}, "Question about {org}", MockResponseModel)
+        fail = Question({"org": "fail"}, "Question about {org}", MockResponseModel)
+
+        first = asyncio.create_task(workflow.ask(fail))
+        while not handler.prompts:
+            await asyncio.sleep(0.001)
+        second = asyncio.create_task(workflow.ask_batch([ok, fail]))
+        for _ in range(100):
+            if await self.storage.get_response_valid(ok):
+                break
+            await asyncio.sleep(0.01)
+        handler.gate.set()
+
+        with pytest.raises(RuntimeError):
+            await first
+        with pytest.raises(RuntimeError):
+            await second
+        assert await self.storage.get_response_valid(ok)
+        assert handler.prompts.count("Question about fail") == 1
+
+    async def test_dump_answers_reuses_extracted_fields(self):
+        """Test that fields are extracted once per stored response across dumps."""
+        if isinstance(self.storage, SQLiteStorageProvider):
+            pytest.skip("SQLite builds a fresh QueryResponse on every read, so there is no cache to reuse")
+        await self.workflow.ask_multiple(self.question_set)
+        extracted = self.handler.extractions
+
+        first = [a async for a in self.workflow.dump_answers()]
+        second = [a async for a in self.workflow.dump_answers()]
+
+        assert len(first) == len(second) == 6
+        assert self.handler.extractions == extracted
+        assert [a.fields for a in first] == [a.fields for a in second]
+
+    async def test_dump_answers_applies_filter(self):
+        """Test that dump_answers only yields answers whose word_set passes every filter."""
+        await self.workflow.ask_multiple(self.question_set)
+
+        answers = [a async for a in self.workflow.dump_answers(filter={
+            "org": lambda v: v == "Org1",
+            "country": lambda v: v != "C",
+            "missing": lambda v: False,
+        })]
+
+        assert sorted(a.question_value for a in answers) == [
+            "Question about Org1 in A", "Question about Org1 in B"
+        ]
+
+    async def test_dump_answers_evaluates_filter_once_per_value(self):
+        """Test that a filter predicate runs once per distinct value, not once per question."""
+        await self.workflow.ask_multiple(self.question_set)
+        seen: List[str] = []
+
+        def org_is_org1(value):
+            seen.append(value)
+            return value == "Org1"
+
+        answers = [a async for a in self.workflow.dump_answers(filter={"org": org_is_org1})]
+
+        assert len(answers) == 3
+        assert sorted(seen) == ["Org1", "Org2"]
+
+    async def test_dump_jsonl_writes_one_flattened_answer_per_line(self, tmp_path):
+        """Test that dump_jsonl writes every stored answer as a flattened JSON line."""
+        await self.workflow.ask_multiple(self.question_set)
+        path = tmp_path / "answers.jsonl"
+
+        written = await self.workflow.dump_jsonl(path, template=self.question_set.template)
+
+        rows = [json.loads(line) for line in path.read_text().splitlines()]
+        assert written == len(rows) == 6
+        assert {(r["org"], r["country"]) for r in rows} == {
+            (org, country) for org in ["Org1", "Org2"] for country in ["A", "B", "C"]
+        }
+        assert all(r["error"] is None and "relevance" in r for r in rows)
+
+    async def test_dump_answers_across_lookahead_windows(self):
+        """Test that every stored answer is yielded in order when the lookahead window is small."""
+        await self.workflow.ask_multiple(self.question_set)
+        stored = [q.value async for q in self.storage.get_stored_questions()]
+
+        answers = [a async for a in self.workflow.dump_answers(lookahead=4)]
+
+        assert [a.question_value for a in answers] == stored